@@ -26,14 +26,25 @@ sys.path.append(PROJECT_ROOT_DIR)
 
 from config import config
 from utility import build_utility as b_util
+from utility import archive_utility
 from common.MyDatabase import MyDatabase
-from common.BuildResult import get_build_result_template
+from common.BuildResult import get_build_result_template, print_build_result, OUTPUTS, OUTPUT_DICT, \
+    OUTPUT_STREAM
+from common.BuildCache import BuildCache, get_build_cache_key
+from common.MetadataCache import MetadataCache
 
 LOGFILE = os.path.join(PROJECT_ROOT_DIR, 'log', 'build.log')
 LOGFILE = os.environ.get('BACKEND_LOGFILE', LOGFILE)
 
+BUILD_CACHE_DIR = os.path.join(PROJECT_ROOT_DIR, config.BUILD_CACHE_DIR)
+DATABASE_VERSION_FILE = os.path.join(PROJECT_ROOT_DIR, config.DATABASE_VERSION_FILE)
+METADATA_SNAPSHOT_FILE = os.path.join(PROJECT_ROOT_DIR, config.METADATA_SNAPSHOT_FILE)
+
+CCACHE_DIR = os.path.join(PROJECT_ROOT_DIR, config.CCACHE_DIR) if config.CCACHE_DIR is not None else None
+
 build_result = get_build_result_template()
 db = MyDatabase()
+metadata_cache = MetadataCache(DATABASE_VERSION_FILE, METADATA_SNAPSHOT_FILE)
 
 
 def main(argv):
@@ -45,60 +56,163 @@ def main(argv):
 
     except Exception as e:
         build_result['cmd_output'] += str(e)
+        print_build_result(build_result)
         return
 
-    board = args.board
-    modules = args.modules
-    main_file_content = args.main_file_content
-    using_cache = args.caching
+    archive_dir = args.archive_dir
+    if args.output == OUTPUT_STREAM and archive_dir is None:
+        archive_dir = os.path.join(PROJECT_ROOT_DIR, 'tmp')
 
-    build_result['board'] = board
+    try:
+        build(db, args.board, args.modules, args.main_file_content, args.caching,
+              args.compression, args.compression_level, archive_dir, build_result)
 
-    app_build_parent_dir = os.path.join(PROJECT_ROOT_DIR, 'RIOT', 'generated_by_rapstore')
+    except Exception as e:
+        logging.error(str(e), exc_info=True)
+        build_result['cmd_output'] += str(e)
 
-    # unique application directory name
-    ticket_id = b_util.get_ticket_id()
+    print_build_result(build_result, args.output)
 
-    app_name = 'application%s' % ticket_id
-    app_build_dir = os.path.join(app_build_parent_dir, app_name)
 
-    temp_dir = b_util.get_temporary_directory(PROJECT_ROOT_DIR, ticket_id)
+def build(db, board, modules, main_file_content, using_cache=False, compression=None, compression_level=None,
+          archive_dir=None, build_result=None):
+    """
+    Build a custom RIOT OS image for the given board and modules
 
-    build_result['application_name'] = app_name
+    Parameters
+    ----------
+    db: MyDatabase
+        Database to fetch module names from
+    board: string
+        Board name
+    modules: array_like with int
+        List with IDs of wanted modules
+    main_file_content: string
+        Content of the main.c file
+    using_cache: bool (default =False)
+        Whether to use cache or not
+    compression: string (default =None)
+        Compression of the archive, None for ARCHIVE_COMPRESSION of config
+    compression_level: int (default =None)
+        Compression level, None for the default level of the compression (ARCHIVE_COMPRESSION_LEVEL of config if
+        compression is None as well)
+    archive_dir: string (default =None)
+        Directory the archive is placed in, its path is returned as output_archive_path. If None, the archive is
+        returned base64 encoded as output_archive
+    build_result: dict (default =None)
+        Build result to fill in, a new one is created if None
 
-    b_util.create_directories(app_build_dir)
+    Returns
+    -------
+    dict
+        Build result
 
-    write_makefile(board, modules, app_name, app_build_dir)
+    """
+    if build_result is None:
+        build_result = get_build_result_template()
 
-    with open(os.path.join(app_build_dir, 'main.c'), 'w') as main_file:
-        main_file.write(main_file_content)
+    build_result['board'] = board
 
-    build_result['cmd_output'] += b_util.execute_makefile(app_build_dir, board, app_name)
+    if compression is None:
+        compression = config.ARCHIVE_COMPRESSION
+
+        # the configured level belongs to the configured compression
+        if compression_level is None:
+            compression_level = config.ARCHIVE_COMPRESSION_LEVEL
 
     try:
-        stripped_repo_path = b_util.generate_stripped_repo(app_build_dir, PROJECT_ROOT_DIR, temp_dir, board, app_name)
+        compression_level = archive_utility.get_compression_level(compression, compression_level)
 
-        archive_path = os.path.join(temp_dir, 'RIOT_stripped.tar')
-        b_util.zip_repo(stripped_repo_path, archive_path)
+    except ValueError as e:
+        build_result['cmd_output'] += str(e)
+        return build_result
+    archive_extension = archive_utility.get_archive_extension(compression)
 
-        archive_extension = 'tar'
+    if metadata_cache.get_board(db, board) is None:
+        build_result['cmd_output'] += 'unknown board: %s' % board
+        return build_result
 
-        build_result['output_archive_extension'] = archive_extension
-        build_result['output_archive'] = b_util.file_as_base64(archive_path)
+    module_names = metadata_cache.get_module_names(db, modules)
 
-        build_result['success'] = True
+    if module_names is None:
+        build_result['cmd_output'] += 'error while reading modules from database'
+        return build_result
 
-    except Exception as e:
-        logging.error(str(e), exc_info=True)
-        build_result['cmd_output'] += 'something went wrong on server side'
+    if not isinstance(main_file_content, bytes):
+        main_file_content = main_file_content.encode('utf-8')
+
+    build_cache = BuildCache(BUILD_CACHE_DIR, config.BUILD_CACHE_MAX_SIZE)
+    cache_key = None
+
+    if using_cache:
+        riot_revision = b_util.get_riot_revision(os.path.join(PROJECT_ROOT_DIR, 'RIOT'))
+
+        if riot_revision is not None:
+            archive_format = '%s-%d' % (compression, compression_level)
+            cache_key = get_build_cache_key(board, module_names, main_file_content, riot_revision, archive_format)
+
+            if get_cached_build(build_cache, cache_key, build_result, archive_dir):
+                return build_result
+
+    ticket_id = b_util.get_ticket_id()
+    temp_dir = b_util.get_temporary_directory(PROJECT_ROOT_DIR, ticket_id)
+
+    app_build_parent_dir = os.path.join(PROJECT_ROOT_DIR, 'RIOT', 'generated_by_rapstore')
+
+    # application directories are reused by later builds, so their paths do not prevent ccache hits
+    app_build_dir, app_build_dir_lock = b_util.lock_build_directory(app_build_parent_dir, b_util.APPLICATION_NAME)
 
-    # delete temporary directories after finished build
     try:
-        rmtree(app_build_dir)
-        rmtree(temp_dir)
+        app_name = b_util.APPLICATION_NAME
 
-    except Exception as e:
-        logging.error(str(e), exc_info=True)
+        build_result['application_name'] = app_name
+
+        b_util.create_directories(app_build_dir)
+
+        write_makefile(board, module_names, app_name, app_build_dir)
+
+        with open(os.path.join(app_build_dir, 'main.c'), 'wb') as main_file:
+            main_file.write(main_file_content)
+
+        make_env = b_util.get_ccache_environment(CCACHE_DIR, config.CCACHE_MAX_SIZE, config.CCACHE_COMPILERS,
+                                                   PROJECT_ROOT_DIR)
+        build_result['cmd_output'] += b_util.execute_makefile(app_build_dir, board, app_name, env=make_env)
+
+        # make failed, the output tells why
+        if not os.path.isfile(b_util.app_outfile_path(b_util.get_bindir(app_build_dir, board), app_name, 'elf')):
+            return build_result
+
+        try:
+            b_util.create_directories(temp_dir)
+
+            archive_path = os.path.join(temp_dir, 'RIOT_stripped.%s' % archive_extension)
+            b_util.generate_stripped_archive(app_build_dir, PROJECT_ROOT_DIR, archive_path, board, app_name,
+                                             config.USE_BASE_ARCHIVES, compression, compression_level)
+
+            b_util.set_output_archive(build_result, archive_path, archive_extension, archive_dir)
+
+            build_result['success'] = True
+
+            if cache_key is not None:
+                cache_build(build_cache, cache_key, build_result, app_build_dir, archive_path)
+
+        except Exception as e:
+            logging.error(str(e), exc_info=True)
+            build_result['cmd_output'] += 'something went wrong on server side'
+
+    finally:
+        # delete temporary directories after finished build, also if it failed on the way
+        for path in (app_build_dir, temp_dir):
+            try:
+                if os.path.exists(path):
+                    rmtree(path)
+
+            except Exception as e:
+                logging.error(str(e), exc_info=True)
+
+        b_util.unlock_build_directory(app_build_dir_lock)
+
+    return build_result
 
 
 def init_argparse():
@@ -127,36 +241,125 @@ def init_argparse():
                         required=False,
                         help='wether to use cache or not')
 
+    parser.add_argument('--compression',
+                        dest='compression', action='store',
+                        choices=archive_utility.COMPRESSIONS,
+                        required=False,
+                        help='compression of the returned archive, default is set in config')
+
+    parser.add_argument('--compression-level',
+                        dest='compression_level', action='store',
+                        type=int,
+                        required=False,
+                        help='compression level (gz and xz 0-9, zst 1-22), default is set in config')
+
+    parser.add_argument('--output',
+                        dest='output', action='store',
+                        choices=OUTPUTS, default=OUTPUT_DICT,
+                        required=False,
+                        help='format of the build result: python dict, JSON, or JSON followed by the raw archive')
+
+    parser.add_argument('--archive-dir',
+                        dest='archive_dir', action='store',
+                        required=False,
+                        help='place the archive in this directory and return its path instead of base64 content')
+
     return parser
 
 
-def fetch_module_name(id):
+def get_cached_build(build_cache, cache_key, build_result, archive_dir=None):
     """
-    Fetch module name from database
+    Fill build result from cache
 
     Parameters
     ----------
-    id: int
-        ID of the module
+    build_cache: BuildCache
+        Cache to look up
+    cache_key: string
+        Key of the build
+    build_result: dict
+        Build result to fill in
+    archive_dir: string (default =None)
+        Directory the archive is placed in, None to embed it base64 encoded
 
     Returns
     -------
-    string
-        Name of the module, None if not found
+    bool
+        True if the build was found in cache
 
     """
-    db.query('SELECT name FROM modules WHERE id=%s', (id,))
-    names = db.fetchall()
+    metadata = build_cache.get_metadata(cache_key)
+
+    if metadata is None:
+        return False
+
+    archive_path = build_cache.get_entry(cache_key, metadata['archive_file_name'])
+
+    if archive_path is None:
+        return False
+
+    try:
+        b_util.set_output_archive(build_result, archive_path, metadata['output_archive_extension'], archive_dir)
+
+    except (IOError, OSError) as e:
+        # entry got evicted in the meantime, build it again
+        logging.error(str(e), exc_info=True)
+        return False
 
-    if len(names) != 1:
-        logging.error('error in database: len(names != 1)')
-        return None
+    build_result['application_name'] = metadata['application_name']
+    build_result['cmd_output'] += metadata['cmd_output']
+    build_result['success'] = True
 
-    else:
-        return names[0]['name']
+    return True
 
 
-def write_makefile(board, modules, application_name, path):
+def cache_build(build_cache, cache_key, build_result, app_build_dir, archive_path):
+    """
+    Store binaries and archive of a successful build in cache
+
+    Parameters
+    ----------
+    build_cache: BuildCache
+        Cache to store the build in
+    cache_key: string
+        Key of the build
+    build_result: dict
+        Build result of the build
+    app_build_dir: string
+        Directory the application was built in
+    archive_path: string
+        Path to the archive returned to the user
+
+    """
+    app_name = build_result['application_name']
+    bin_dir = b_util.get_bindir(app_build_dir, build_result['board'])
+
+    src_paths = [archive_path]
+    for extension in ('elf', 'hex', 'bin'):
+        outfile_path = b_util.app_outfile_path(bin_dir, app_name, extension)
+
+        if os.path.isfile(outfile_path):
+            src_paths.append(outfile_path)
+
+    cmd_output = build_result['cmd_output']
+    if isinstance(cmd_output, bytes):
+        cmd_output = cmd_output.decode('utf-8', 'replace')
+
+    metadata = {
+        'application_name': app_name,
+        'archive_file_name': os.path.basename(archive_path),
+        'output_archive_extension': build_result['output_archive_extension'],
+        'cmd_output': cmd_output
+    }
+
+    try:
+        build_cache.cache(cache_key, src_paths, metadata)
+
+    except Exception as e:
+        logging.error(str(e), exc_info=True)
+
+
+def write_makefile(board, module_names, application_name, path):
     """
     Write a custom makefile including board and modules
 
@@ -164,8 +367,8 @@ def write_makefile(board, modules, application_name, path):
     ----------
     board: string
         Board name
-    modules: array_like with int
-        List with IDs of wanted modules
+    module_names: array_like with string
+        List with names of wanted modules
     application_name: string
         Name ot the application
     path: string
@@ -183,16 +386,9 @@ def write_makefile(board, modules, application_name, path):
 
         makefile.write('RIOTBASE ?= $(CURDIR)/../..')
         makefile.write('\n\n')
-        
-        for module in modules:
-            module_name = fetch_module_name(module)
 
-            if module_name is None:
-                build_result['cmd_output'] += 'error while reading modules from database'
-                break
-
-            else :
-                makefile.write('USEMODULE += %s\n' % module_name)
+        for module_name in module_names:
+            makefile.write('USEMODULE += %s\n' % module_name)
 
         makefile.write('\n')
         makefile.write('include $(RIOTBASE)/Makefile.include')
@@ -209,5 +405,4 @@ if __name__ == '__main__':
     except Exception as e:
         logging.error(str(e), exc_info=True)
         build_result['cmd_output'] += str(e)
-
-    print(build_result)
+        print_build_result(build_result)
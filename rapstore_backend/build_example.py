@@ -16,7 +16,7 @@ import logging
 import os
 import sys
 import time
-from shutil import copytree, rmtree, copyfile
+from shutil import rmtree
 
 # append root of the python code tree to sys.apth so that imports are working
 #   alternative: add path to rapstore_backend to the PYTHONPATH environment variable, but this includes one more step
@@ -27,19 +27,25 @@ sys.path.append(PROJECT_ROOT_DIR)
 
 from config import config
 from utility import build_utility as b_util
-from utility import application_info_utility as a_util
+from utility import archive_utility
 from common.MyDatabase import MyDatabase
 from common.ApplicationCache import ApplicationCache
 from common.common import create_directories
-from common.BuildResult import get_build_result_template
+from common.MetadataCache import MetadataCache
+from common.BuildResult import get_build_result_template, print_build_result, OUTPUTS, OUTPUT_DICT, \
+    OUTPUT_STREAM
 
 LOGFILE = os.path.join(PROJECT_ROOT_DIR, 'log', 'build_example.log')
 LOGFILE = os.environ.get('BACKEND_LOGFILE', LOGFILE)
 
 APPLICATION_CACHE_DIR = os.path.join(PROJECT_ROOT_DIR, config.APPLICATION_CACHE_DIR)
+DATABASE_VERSION_FILE = os.path.join(PROJECT_ROOT_DIR, config.DATABASE_VERSION_FILE)
+METADATA_SNAPSHOT_FILE = os.path.join(PROJECT_ROOT_DIR, config.METADATA_SNAPSHOT_FILE)
+CCACHE_DIR = os.path.join(PROJECT_ROOT_DIR, config.CCACHE_DIR) if config.CCACHE_DIR is not None else None
 
 build_result = get_build_result_template()
 db = MyDatabase()
+metadata_cache = MetadataCache(DATABASE_VERSION_FILE, METADATA_SNAPSHOT_FILE)
 
 
 def main(argv):
@@ -51,108 +57,225 @@ def main(argv):
 
     except Exception as e:
         build_result['cmd_output'] += str(e)
+        print_build_result(build_result)
         return
 
-    board = args.board
-    application_id = args.application
-    using_cache = args.caching
-    prefetching = args.prefetching
+    archive_dir = args.archive_dir
+    if args.output == OUTPUT_STREAM and archive_dir is None:
+        archive_dir = os.path.join(PROJECT_ROOT_DIR, 'tmp')
 
-    application_cache = ApplicationCache(APPLICATION_CACHE_DIR)
+    try:
+        build(db, args.application, args.board, args.caching, args.prefetching, args.prefetch_archive,
+              args.compression, args.compression_level, archive_dir, build_result, args.jobs)
+
+    except Exception as e:
+        logging.error(str(e), exc_info=True)
+        build_result['cmd_output'] += str(e)
+
+    print_build_result(build_result, args.output)
+
+
+def build(db, application_id, board, using_cache=False, prefetching=False, prefetch_archive=False,
+          compression=None, compression_level=None, archive_dir=None, build_result=None, make_jobs=None):
+    """
+    Build an example application for the given board
 
-    source_app_name = a_util.get_application_name(db, application_id)
-    source_app_dir_name = os.path.basename(a_util.get_application_path(db, application_id))
+    Parameters
+    ----------
+    db: MyDatabase
+        Database to fetch application information from
+    application_id: int
+        ID of the application
+    board: string
+        Board name
+    using_cache: bool (default =False)
+        Whether to use cache or not
+    prefetching: bool (default =False)
+        If set, binaries are just generated and cached. Further steps are ignored
+    prefetch_archive: bool (default =False)
+        If set together with prefetching, the archive is generated and cached as well
+    compression: string (default =None)
+        Compression of the archive, None for ARCHIVE_COMPRESSION of config
+    compression_level: int (default =None)
+        Compression level, None for the default level of the compression (ARCHIVE_COMPRESSION_LEVEL of config if
+        compression is None as well)
+    archive_dir: string (default =None)
+        Directory the archive is placed in, its path is returned as output_archive_path. If None, the archive is
+        returned base64 encoded as output_archive
+    build_result: dict (default =None)
+        Build result to fill in, a new one is created if None
+    make_jobs: int (default =None)
+        Number of jobs make runs in parallel, None for the default of make
+
+    Returns
+    -------
+    dict
+        Build result
+
+    """
+    if build_result is None:
+        build_result = get_build_result_template()
 
     build_result['board'] = board
 
-    app_build_parent_dir = os.path.join(PROJECT_ROOT_DIR, 'RIOT', 'generated_by_rapstore')
+    if compression is None:
+        compression = config.ARCHIVE_COMPRESSION
 
-    # unique application directory name
-    ticket_id = b_util.get_ticket_id()
+        # the configured level belongs to the configured compression
+        if compression_level is None:
+            compression_level = config.ARCHIVE_COMPRESSION_LEVEL
 
-    app_name = 'application%s' % ticket_id
-    app_build_dir = os.path.join(app_build_parent_dir, app_name)
+    try:
+        compression_level = archive_utility.get_compression_level(compression, compression_level)
 
-    temp_dir = b_util.get_temporary_directory(PROJECT_ROOT_DIR, ticket_id)
-    create_directories(temp_dir)
+    except ValueError as e:
+        build_result['cmd_output'] += str(e)
+        return build_result
 
-    build_result['application_name'] = app_name
+    application_cache = ApplicationCache(APPLICATION_CACHE_DIR, config.APPLICATION_CACHE_MAX_SIZE)
+
+    if metadata_cache.get_board(db, board) is None:
+        build_result['cmd_output'] += 'unknown board: %s' % board
+        return build_result
 
-    app_path = os.path.join(PROJECT_ROOT_DIR, a_util.get_application_path(db, application_id))
+    application = metadata_cache.get_application(db, application_id)
 
-    copytree(app_path, app_build_dir)
+    if application is None:
+        build_result['cmd_output'] += 'error while reading application from database'
+        return build_result
 
-    app_build_dir_abs_path = os.path.abspath(app_build_dir)
-    bin_dir = b_util.get_bindir(app_build_dir_abs_path, board)
+    source_app_name = application['name']
+    source_app_dir_name = os.path.basename(application['path'])
 
-    cached_binaries = False
-    if using_cache:
+    # binaries are cached under the name of the application and renamed when they are taken from cache
+    app_name = b_util.APPLICATION_NAME
+    build_result['application_name'] = app_name
 
-        cached_elffile_path = application_cache.get_entry(board, source_app_dir_name, '%s.elf' % source_app_name)
-        cached_hexfile_path = application_cache.get_entry(board, source_app_dir_name, '%s.hex' % source_app_name)
+    archive_extension = archive_utility.get_archive_extension(compression)
+    archive_file_name = b_util.archive_file_name(compression_level, archive_extension)
 
-        if (cached_elffile_path is not None) or (cached_hexfile_path is not None):
+    creating_archive = not prefetching or prefetch_archive
 
-            cached_binaries = True
+    if using_cache and creating_archive:
 
-            create_directories(bin_dir)
+        cached_archive_path = application_cache.get_entry(board, source_app_dir_name, archive_file_name)
 
-            # copy files from cache in to bin_dir.
-            # Need to rename it because further steps expect given name based on ticketID
-            if cached_elffile_path is not None:
-                copyfile(cached_elffile_path, os.path.join(bin_dir, '%s.elf' % app_name))
+        if cached_archive_path is not None:
+            try:
+                if not prefetching:
+                    b_util.set_output_archive(build_result, cached_archive_path, archive_extension, archive_dir)
+
+                build_result['success'] = True
+                return build_result
+
+            except (IOError, OSError) as e:
+                # entry got evicted in the meantime, build it instead
+                logging.debug(str(e))
+
+    ticket_id = b_util.get_ticket_id()
+    temp_dir = b_util.get_temporary_directory(PROJECT_ROOT_DIR, ticket_id)
 
-            if cached_hexfile_path is not None:
-                copyfile(cached_hexfile_path, os.path.join(bin_dir, '%s.hex' % app_name))
+    app_build_parent_dir = os.path.join(PROJECT_ROOT_DIR, 'RIOT', 'generated_by_rapstore')
 
-    if not cached_binaries:
-        # if nothing found in cache, just build it
-        replace_application_name(os.path.join(app_build_dir, 'Makefile'), app_name)
-        before = time.time()
-        build_result['cmd_output'] += b_util.execute_makefile(app_build_dir, board, app_name)
-        logging.debug('Build time: %f', time.time() - before)
+    # application directories are reused by later builds, so their paths do not prevent ccache hits
+    app_build_dir, app_build_dir_lock = b_util.lock_build_directory(app_build_parent_dir, b_util.APPLICATION_NAME)
 
     try:
+        create_directories(temp_dir)
+
+        app_path = os.path.join(PROJECT_ROOT_DIR, application['path'])
+
+        # the Makefile gets rewritten, all other files are only read
+        b_util.materialize_tree(app_path, app_build_dir, copied_paths=['Makefile'])
+        b_util.replace_application_name(os.path.join(app_build_dir, 'Makefile'), app_name)
+
+        app_build_dir_abs_path = os.path.abspath(app_build_dir)
+        bin_dir = b_util.get_bindir(app_build_dir_abs_path, board)
+
+        cached_binaries = False
+        if using_cache:
+
+            cached_elffile_path = application_cache.get_entry(board, source_app_dir_name, '%s.elf' % source_app_name)
+            cached_hexfile_path = application_cache.get_entry(board, source_app_dir_name, '%s.hex' % source_app_name)
+
+            if (cached_elffile_path is not None) or (cached_hexfile_path is not None):
+
+                cached_binaries = True
+
+                create_directories(bin_dir)
 
-        if not prefetching:
-            stripped_repo_path = b_util.generate_stripped_repo(app_build_dir, PROJECT_ROOT_DIR, temp_dir, board, app_name)
+                # link files from cache in to bin_dir
+                try:
+                    if cached_elffile_path is not None:
+                        b_util.export_file(cached_elffile_path, b_util.app_outfile_path(bin_dir, app_name, 'elf'))
 
-            archive_path = os.path.join(temp_dir, 'RIOT_stripped.tar')
+                    if cached_hexfile_path is not None:
+                        b_util.export_file(cached_hexfile_path, b_util.app_outfile_path(bin_dir, app_name, 'hex'))
+
+                except (IOError, OSError) as e:
+                    # entry got evicted in the meantime, build it instead
+                    logging.debug(str(e))
+                    cached_binaries = False
+
+        if not cached_binaries:
+            # if nothing found in cache, just build it
             before = time.time()
-            b_util.zip_repo(stripped_repo_path, archive_path)
-            logging.debug('Create archive time: %f', time.time() - before)
+            make_env = b_util.get_ccache_environment(CCACHE_DIR, config.CCACHE_MAX_SIZE, config.CCACHE_COMPILERS,
+                                                       PROJECT_ROOT_DIR)
+            build_result['cmd_output'] += b_util.execute_makefile(app_build_dir, board, app_name, make_jobs, make_env)
+            logging.debug('Build time: %f', time.time() - before)
 
-            archive_extension = 'tar'
+        # make failed, the output tells why
+        if not os.path.isfile(b_util.app_outfile_path(bin_dir, app_name, 'elf')):
+            return build_result
 
-            build_result['output_archive_extension'] = archive_extension
-            build_result['output_archive'] = b_util.file_as_base64(archive_path)
+        try:
 
-            build_result['success'] = True
+            if creating_archive:
+                archive_path = os.path.join(temp_dir, archive_file_name)
+                before = time.time()
+                b_util.generate_stripped_archive(app_build_dir, PROJECT_ROOT_DIR, archive_path, board, app_name,
+                                                 config.USE_BASE_ARCHIVES, compression, compression_level)
+                logging.debug('Create archive time: %f', time.time() - before)
 
-        else:
+                if using_cache:
+                    application_cache.cache(archive_path, board, source_app_dir_name, archive_file_name)
 
-            # get compiled binaries
-            elffile_path = b_util.app_elffile_path(bin_dir, app_name)
-            hexfile_path = b_util.app_hexfile_path(bin_dir, app_name)
+            if not prefetching:
+                b_util.set_output_archive(build_result, archive_path, archive_extension, archive_dir)
 
-            if os.path.isfile(elffile_path) and os.path.isfile(hexfile_path):
                 build_result['success'] = True
 
-        if prefetching:
-            # cache application
-            cache_application(application_cache, bin_dir, temp_dir, board, app_name, source_app_name, source_app_dir_name)
+            else:
 
-    except Exception as e:
-        logging.error(str(e), exc_info=True)
-        build_result['cmd_output'] += 'something went wrong on server side'
+                # get compiled binaries
+                elffile_path = b_util.app_outfile_path(bin_dir, app_name, 'elf')
+                hexfile_path = b_util.app_outfile_path(bin_dir, app_name, 'hex')
 
-    # delete temporary directories after finished build
-    try:
-        rmtree(app_build_dir)
-        rmtree(temp_dir)
+                if os.path.isfile(elffile_path) and os.path.isfile(hexfile_path):
+                    build_result['success'] = True
 
-    except Exception as e:
-        logging.error(str(e), exc_info=True)
+            if prefetching:
+                # cache application
+                cache_application(application_cache, bin_dir, board, app_name, source_app_name, source_app_dir_name)
+
+        except Exception as e:
+            logging.error(str(e), exc_info=True)
+            build_result['cmd_output'] += 'something went wrong on server side'
+
+    finally:
+        # delete temporary directories after finished build, also if it failed on the way
+        for path in (app_build_dir, temp_dir):
+            try:
+                if os.path.exists(path):
+                    rmtree(path)
+
+            except Exception as e:
+                logging.error(str(e), exc_info=True)
+
+        b_util.unlock_build_directory(app_build_dir_lock)
+
+    return build_result
 
 
 def init_argparse():
@@ -180,64 +303,54 @@ def init_argparse():
                         required=False,
                         help='if flag is set, binaries are just generated. Further steps are ignored')
 
-    return parser
-
-
-def cache_application(cache, bin_dir, temp_dir, board, app_name, source_app_name, source_app_dir_name):
-
-    # get compiled binaries
-    elffile_path = b_util.app_elffile_path(bin_dir, app_name)
-    hexfile_path = b_util.app_hexfile_path(bin_dir, app_name)
-
-    # set new name for the file which should be cached with this name
-    cached_elffile_name = '%s.elf' % source_app_name
-    cached_hexfile_name = '%s.hex' % source_app_name
-
-    # set path to files to be cached
-    path_elffile_to_cache = os.path.join(temp_dir, cached_elffile_name)
-    path_hexfile_to_cache = os.path.join(temp_dir, cached_hexfile_name)
+    parser.add_argument('--prefetch-archive',
+                        dest='prefetch_archive', action='store_true', default=False,
+                        required=False,
+                        help='if set together with --prefetching, the archive is generated and cached as well')
 
-    # copy files with new names to temp_dir
-    try:
-        copyfile(elffile_path, path_elffile_to_cache)
-        # reference to renamed copy for caching purpose
-        cache.cache(path_elffile_to_cache, board, source_app_dir_name, cached_elffile_name)
-    except Exception as e:
-        logging.debug(str(e))
+    parser.add_argument('--compression',
+                        dest='compression', action='store',
+                        choices=archive_utility.COMPRESSIONS,
+                        required=False,
+                        help='compression of the returned archive, default is set in config')
 
-    try:
-        copyfile(hexfile_path, path_hexfile_to_cache)
-        # reference to renamed copy for caching purpose
-        cache.cache(path_hexfile_to_cache, board, source_app_dir_name, cached_hexfile_name)
-    except Exception as e:
-        logging.debug(str(e))
+    parser.add_argument('--compression-level',
+                        dest='compression_level', action='store',
+                        type=int,
+                        required=False,
+                        help='compression level (gz and xz 0-9, zst 1-22), default is set in config')
 
+    parser.add_argument('--output',
+                        dest='output', action='store',
+                        choices=OUTPUTS, default=OUTPUT_DICT,
+                        required=False,
+                        help='format of the build result: python dict, JSON, or JSON followed by the raw archive')
 
-def replace_application_name(path, application_name):
-    """
-    Replace application name in line which starts with "APPLICATION="
+    parser.add_argument('--archive-dir',
+                        dest='archive_dir', action='store',
+                        required=False,
+                        help='place the archive in this directory and return its path instead of base64 content')
 
-    Parameters
-    ----------
-    path: string
-        Path to the file
+    parser.add_argument('--jobs',
+                        dest='jobs', action='store',
+                        type=int,
+                        required=False,
+                        help='number of jobs make runs in parallel')
 
-    application_name: string
-        Name of the application
+    return parser
 
-    """
 
-    # Save the old one to check later in case there is an error
-    copyfile(path, path + '.old')
+def cache_application(cache, bin_dir, board, app_name, source_app_name, source_app_dir_name):
 
-    with open(path + '.old', 'r') as old_makefile:
-        with open(path, 'w') as makefile:
+    for extension in ('elf', 'hex'):
 
-            for line in old_makefile.readlines():
-                if line.replace(' ', '').startswith('APPLICATION='):
-                    line = 'APPLICATION = %s\n' % application_name
+        outfile_path = b_util.app_outfile_path(bin_dir, app_name, extension)
 
-                makefile.write(line)
+        try:
+            # cached under the name of the application, not the one it was built with
+            cache.cache(outfile_path, board, source_app_dir_name, '%s.%s' % (source_app_name, extension))
+        except Exception as e:
+            logging.debug(str(e))
 
 
 if __name__ == '__main__':
@@ -251,5 +364,4 @@ if __name__ == '__main__':
     except Exception as e:
         logging.error(str(e), exc_info=True)
         build_result['cmd_output'] += str(e)
-
-    print(build_result)
+        print_build_result(build_result)
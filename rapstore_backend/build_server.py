@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+ * Copyright (C) 2017 Hendrik van Essen
+ *
+ * This file is subject to the terms and conditions of the GNU Lesser
+ * General Public License v2.1. See the file LICENSE in the top level
+ * directory for more details.
+"""
+
+# Long-lived build service. Instead of starting build.py or build_example.py for every request, clients connect to a
+# unix socket and send one JSON encoded build job per line, e.g.
+#
+#   {"action": "build", "board": "samr21-xpro", "modules": [1, 2], "main_file_content": "...", "caching": true}
+#   {"action": "build_example", "board": "samr21-xpro", "application": 3, "caching": true}
+#
+# For every job one line with the JSON encoded build result is written back. A connection can be used for several jobs.
+# By default the archive is embedded base64 encoded. With "archive_dir" set, the archive is placed in that directory
+# and only its path is returned, archive_dir has to be below tmp/ or BUILD_SERVER_ARCHIVE_DIR of config. With
+# "stream_archive" set, the result line is followed by output_archive_size bytes of the raw archive.
+
+from __future__ import print_function
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+
+try:
+    import SocketServer as socketserver
+except ImportError:
+    import socketserver
+
+# append root of the python code tree to sys.apth so that imports are working
+#   alternative: add path to rapstore_backend to the PYTHONPATH environment variable, but this includes one more step
+#   which could be forget
+CUR_DIR = os.path.abspath(os.path.dirname(__file__))
+PROJECT_ROOT_DIR = os.path.normpath(os.path.join(CUR_DIR, os.pardir))
+sys.path.append(PROJECT_ROOT_DIR)
+
+from config import config
+from common.MyDatabase import MyDatabase
+from common.BuildResult import get_build_result_template, write_build_result
+import build as custom_build
+import build_example as example_build
+
+LOGFILE = os.path.join(PROJECT_ROOT_DIR, 'log', 'build_server.log')
+LOGFILE = os.environ.get('BACKEND_LOGFILE', LOGFILE)
+
+SOCKET_PATH = os.path.join(PROJECT_ROOT_DIR, config.BUILD_SERVER_SOCKET)
+
+TEMP_DIR = os.path.join(PROJECT_ROOT_DIR, 'tmp')
+
+# archives are only placed below these directories
+ARCHIVE_DIRS = [TEMP_DIR]
+if config.BUILD_SERVER_ARCHIVE_DIR is not None:
+    ARCHIVE_DIRS.append(os.path.join(PROJECT_ROOT_DIR, config.BUILD_SERVER_ARCHIVE_DIR))
+
+
+class BuildRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Read build jobs line by line from the connection and answer each of them with its build result
+
+    """
+
+    def handle(self):
+
+        while True:
+            line = self.rfile.readline()
+
+            if not line:
+                # client closed the connection
+                return
+
+            if not line.strip():
+                continue
+
+            build_result, stream_archive = self.server.execute_job(line)
+
+            write_build_result(build_result, self.wfile, stream_archive)
+
+
+class BuildServer(socketserver.ThreadingUnixStreamServer):
+    """
+    Unix socket server executing build jobs with a limited amount of parallel builds. Every handler thread uses its
+    own database connection, which goes back to the connection pool after each job
+
+    """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, max_jobs):
+
+        # remove stale socket of a previous run
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+        socketserver.ThreadingUnixStreamServer.__init__(self, socket_path, BuildRequestHandler)
+
+        self._job_slots = threading.BoundedSemaphore(max_jobs)
+        self._db = MyDatabase()
+
+    def execute_job(self, line):
+        """
+        Execute a single build job
+
+        Parameters
+        ----------
+        line: string
+            JSON encoded build job
+
+        Returns
+        -------
+        tuple
+            Build result and whether the archive should be streamed after it
+
+        """
+        try:
+            job = json.loads(line)
+
+        except ValueError as e:
+            build_result = get_build_result_template()
+            build_result['cmd_output'] += 'invalid build job: %s' % str(e)
+            return build_result, False
+
+        stream_archive = bool(job.get('stream_archive', False))
+
+        archive_dir = job.get('archive_dir')
+        if stream_archive and archive_dir is None:
+            archive_dir = TEMP_DIR
+
+        if archive_dir is not None:
+            archive_dir = get_allowed_archive_dir(archive_dir)
+
+            if archive_dir is None:
+                build_result = get_build_result_template()
+                build_result['cmd_output'] += 'archive_dir is not allowed: %s' % job.get('archive_dir')
+                return build_result, False
+
+        self._job_slots.acquire()
+
+        try:
+            return run_job(self._db, job, archive_dir), stream_archive
+
+        except Exception as e:
+            logging.error(str(e), exc_info=True)
+
+            build_result = get_build_result_template()
+            build_result['cmd_output'] += str(e)
+            return build_result, False
+
+        finally:
+            self._db.close()
+            self._job_slots.release()
+
+
+def get_allowed_archive_dir(archive_dir):
+    """
+    Resolve a directory requested by a client and check that it is below one of ARCHIVE_DIRS
+
+    Parameters
+    ----------
+    archive_dir: string
+        Requested directory, relative paths are relative to the project root
+
+    Returns
+    -------
+    string
+        Resolved directory, None if it is not allowed
+
+    """
+    archive_dir = os.path.realpath(os.path.join(PROJECT_ROOT_DIR, archive_dir))
+
+    for allowed_dir in ARCHIVE_DIRS:
+        allowed_dir = os.path.realpath(allowed_dir)
+
+        if archive_dir == allowed_dir or archive_dir.startswith(allowed_dir + os.sep):
+            return archive_dir
+
+    return None
+
+
+def run_job(db, job, archive_dir=None):
+    """
+    Dispatch a build job to the matching build function
+
+    Parameters
+    ----------
+    db: MyDatabase
+        Database connection used for the build
+    job: dict
+        Decoded build job
+    archive_dir: string (default =None)
+        Directory the archive is placed in, None to embed it base64 encoded
+
+    Returns
+    -------
+    dict
+        Build result
+
+    Raises
+    -------
+    ValueError
+        Unknown action
+
+    """
+    action = job.get('action')
+
+    if action == 'build':
+        return custom_build.build(db, job['board'], job['modules'], job['main_file_content'],
+                                  job.get('caching', False),
+                                  job.get('compression'), job.get('compression_level'), archive_dir)
+
+    elif action == 'build_example':
+        return example_build.build(db, int(job['application']), job['board'],
+                                   job.get('caching', False), job.get('prefetching', False),
+                                   job.get('prefetch_archive', False),
+                                   job.get('compression'), job.get('compression_level'), archive_dir)
+
+    else:
+        raise ValueError('unknown action: %s' % action)
+
+
+def init_argparse():
+
+    parser = argparse.ArgumentParser(description='Run build service for RIOT OS')
+
+    parser.add_argument('--socket',
+                        dest='socket', action='store',
+                        default=SOCKET_PATH,
+                        required=False,
+                        help='path to the unix socket to listen on')
+
+    parser.add_argument('--jobs',
+                        dest='jobs', action='store',
+                        type=int,
+                        default=config.BUILD_SERVER_MAX_JOBS,
+                        required=False,
+                        help='maximum number of parallel builds')
+
+    return parser
+
+
+def main(argv):
+
+    args = init_argparse().parse_args(argv)
+
+    server = BuildServer(args.socket, args.jobs)
+    logging.info('listening on %s with %d build slots', args.socket, args.jobs)
+
+    try:
+        server.serve_forever()
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        server.server_close()
+        os.remove(args.socket)
+
+
+if __name__ == '__main__':
+
+    logging.basicConfig(filename=LOGFILE, format=config.LOGGING_FORMAT,
+                        datefmt='%Y-%m-%d %H:%M:%S', level=logging.DEBUG)
+
+    try:
+        main(sys.argv[1:])
+
+    except Exception as e:
+        logging.error(str(e), exc_info=True)
@@ -8,10 +8,8 @@
  * General Public License v2.1. See the file LICENSE in the top level
  * directory for more details.
 """
-import logging
 import os
 import sys
-from shutil import copyfile
 
 # append root of the python code tree to sys.apth so that imports are working
 #   alternative: add path to rapstore_backend to the PYTHONPATH environment variable, but this includes one more step
@@ -20,48 +18,73 @@ CUR_DIR = os.path.abspath(os.path.dirname(__file__))
 PROJECT_ROOT_DIR = os.path.normpath(os.path.join(CUR_DIR, os.pardir, os.pardir))
 sys.path.append(PROJECT_ROOT_DIR)
 
-from common import create_directories
+from ArtifactStore import ArtifactStore
 
 
 class ApplicationCache(object):
+    """
+    Cache for files generated by building example applications, indexed by board, application directory and file name
 
-    _cache_dir = None
+    """
 
-    def __init__(self, cache_dir):
-        self._cache_dir = cache_dir
+    _store = None
 
-    def get_entry(self, board, app_dir_name, file_name):
-
-        cache_path = os.path.join(self._cache_dir, board, app_dir_name)
+    def __init__(self, cache_dir, max_size):
+        self._store = ArtifactStore(cache_dir, max_size)
 
-        result_file_path = os.path.join(cache_path, file_name)
-        ready_to_use_file = os.path.join(cache_path, ".ready_to_use")
+    def get_entry(self, board, app_dir_name, file_name):
 
-        if not os.path.isfile(result_file_path):
-            logging.debug("cache MISS: %s" % result_file_path)
-            return None
+        return self._store.get_entry(_get_key(board, app_dir_name, file_name))
 
-        if os.path.isfile(ready_to_use_file):
-            logging.debug("cache HIT: %s" % result_file_path)
-            return result_file_path
+    def contains(self, board, app_dir_name, file_name):
 
-        else:
-            logging.debug("cache FAIL: %s" % result_file_path)
-            return None
+        return self._store.contains(_get_key(board, app_dir_name, file_name))
 
     def cache(self, src_path, board, app_dir_name, file_name):
 
-        create_directories(self._cache_dir)
+        key = _get_key(board, app_dir_name, file_name)
 
         # only store if not in cache already
-        if self.get_entry(board, app_dir_name, file_name) is None:
+        if not self._store.contains(key):
+            self._store.cache(src_path, key)
+
+    def invalidate(self, board=None, app_dir_name=None):
+        """
+        Remove all entries of a board, of an application or of both. Without arguments, every entry is removed
+
+        Parameters
+        ----------
+        board: string (default =None)
+            Board name, None for all boards
+        app_dir_name: string (default =None)
+            Name of the application directory, None for all applications
+
+        Returns
+        -------
+        int
+            Number of removed entries
+
+        """
+        board_pattern = "*" if board is None else _escape_pattern(board)
+        app_pattern = "*" if app_dir_name is None else _escape_pattern(app_dir_name)
+
+        return self._store.remove_matching(_get_key(board_pattern, app_pattern, "*"))
+
+    def get_statistics(self):
+
+        return self._store.get_statistics()
+
+    def repair(self):
+
+        return self._store.repair()
+
+
+def _get_key(board, app_dir_name, file_name):
+
+    return "/".join((board, app_dir_name, file_name))
 
-            dest_in_cache = os.path.join(self._cache_dir, board, app_dir_name)
 
-            create_directories(dest_in_cache)
-            logging.debug("CACHING: %s" % file_name)
-            copyfile(src_path, os.path.join(dest_in_cache, file_name))
+def _escape_pattern(name):
 
-            # show that cached application/module is now ready to use
-            ready_file_path = os.path.join(dest_in_cache, ".ready_to_use")
-            open(ready_file_path, "a").close()
+    # match special characters of GLOB patterns literally
+    return "".join("[%s]" % char if char in "[]*?" else char for char in name)
@@ -0,0 +1,528 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+ * Copyright (C) 2017 Hendrik van Essen
+ *
+ * This file is subject to the terms and conditions of the GNU Lesser
+ * General Public License v2.1. See the file LICENSE in the top level
+ * directory for more details.
+"""
+
+import atexit
+import hashlib
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from shutil import rmtree
+
+# append root of the python code tree to sys.apth so that imports are working
+#   alternative: add path to rapstore_backend to the PYTHONPATH environment variable, but this includes one more step
+#   which could be forget
+CUR_DIR = os.path.abspath(os.path.dirname(__file__))
+PROJECT_ROOT_DIR = os.path.normpath(os.path.join(CUR_DIR, os.pardir, os.pardir))
+sys.path.append(PROJECT_ROOT_DIR)
+
+from common import create_directories
+
+INDEX_FILE_NAME = "index.sqlite"
+OBJECTS_DIR_NAME = "objects"
+
+CHUNK_SIZE = 1024 * 1024
+
+# access times and hit and miss counters are written to the index at most once per interval, so lookups do not need a
+# write transaction each
+ACCESS_FLUSH_INTERVAL = 10
+
+# files younger than this may belong to a cache call in progress, repair leaves them alone
+REPAIR_MIN_AGE = 60 * 60
+
+
+def get_checksum(path):
+    """
+    Calculate SHA-256 checksum of a file
+
+    Parameters
+    ----------
+    path: string
+        Path to the file
+
+    Returns
+    -------
+    string
+        Hex digest of the file content
+
+    """
+    sha = hashlib.sha256()
+
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            sha.update(chunk)
+
+    return sha.hexdigest()
+
+
+def _copy_with_checksum(src_path, dest_path):
+    """
+    Copy a file and calculate the SHA-256 checksum of the copied content on the way
+
+    """
+    sha = hashlib.sha256()
+
+    with open(src_path, "rb") as src_file:
+        with open(dest_path, "wb") as dest_file:
+            for chunk in iter(lambda: src_file.read(CHUNK_SIZE), b""):
+                sha.update(chunk)
+                dest_file.write(chunk)
+
+    return sha.hexdigest()
+
+
+class _AccessLog(object):
+    """
+    Access times and counters not written to an index yet, shared by all stores of a process using the same index
+
+    """
+
+    def __init__(self):
+        self.last_access = {}
+        self.counters = {}
+        self.last_flush_time = 0
+        self.lock = threading.Lock()
+
+    def record(self, key=None, counter=None):
+        """
+        Record an access, return True if the log should be written to the index
+
+        """
+        with self.lock:
+            if key is not None:
+                self.last_access[key] = time.time()
+
+            if counter is not None:
+                self.counters[counter] = self.counters.get(counter, 0) + 1
+
+            return time.time() - self.last_flush_time >= ACCESS_FLUSH_INTERVAL
+
+    def flush(self, connection):
+        """
+        Write recorded accesses to the index, the caller commits
+
+        """
+        with self.lock:
+            last_access = self.last_access
+            counters = self.counters
+            self.last_access = {}
+            self.counters = {}
+            self.last_flush_time = time.time()
+
+        if last_access:
+            # entries removed in the meantime are not matched
+            connection.executemany("UPDATE entries SET last_access=MAX(last_access, ?) WHERE key=?",
+                                   [(access_time, key) for key, access_time in last_access.items()])
+
+        for name, value in counters.items():
+            connection.execute("INSERT OR IGNORE INTO counters (name, value) VALUES (?, 0)", (name,))
+            connection.execute("UPDATE counters SET value=value+? WHERE name=?", (value, name))
+
+
+_access_logs = {}
+_access_logs_lock = threading.Lock()
+
+
+def _get_access_log(index_path):
+
+    with _access_logs_lock:
+        if index_path not in _access_logs:
+            _access_logs[index_path] = _AccessLog()
+
+        return _access_logs[index_path]
+
+
+def _connect(index_path):
+
+    connection = sqlite3.connect(index_path, timeout=60)
+
+    # readers do not block the writer and the other way round, commits do not wait for the disk
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+
+    return connection
+
+
+@atexit.register
+def _flush_access_logs():
+    """Write accesses recorded since the last flush before the process ends."""
+    for index_path, access_log in list(_access_logs.items()):
+        try:
+            connection = _connect(index_path)
+
+            try:
+                access_log.flush(connection)
+                connection.commit()
+
+            finally:
+                connection.close()
+
+        except sqlite3.Error as e:
+            logging.debug(str(e))
+
+
+class ArtifactStore(object):
+    """
+    File store with an SQLite index. Every file is stored under a key, together with its size, checksum and time of
+    last access. Files are written to a temporary name and renamed into place before they are added to the index, so
+    an indexed file is always complete. If the stored files exceed the byte budget, least recently used entries are
+    removed
+
+    Lookups only read the index. Access times and counters are collected in memory and written at most every
+    ACCESS_FLUSH_INTERVAL seconds, before an eviction and when the process ends
+
+    A lookup only compares the size of the stored file with the indexed one. Checksums are verified by repair()
+
+    Methods
+    -------
+    get_entry(key)
+        Get path to the file stored under key
+    contains(key)
+        Check if key is in store without counting a hit or miss
+    cache(src_path, key)
+        Store a copy of a file under key
+    remove(key)
+        Remove entry from store
+    remove_matching(key_pattern)
+        Remove all entries with keys matching a pattern
+    get_statistics()
+        Get hit, miss and eviction counters
+    repair()
+        Remove corrupt entries and files not belonging to an entry
+
+    """
+
+    _store_dir = None
+    _objects_dir = None
+    _max_size = None
+    _connection = None
+    _access_log = None
+
+    def __init__(self, store_dir, max_size):
+        self._store_dir = store_dir
+        self._objects_dir = os.path.join(store_dir, OBJECTS_DIR_NAME)
+        self._max_size = max_size
+        self._access_log = _get_access_log(os.path.join(store_dir, INDEX_FILE_NAME))
+
+    def _get_connection(self):
+
+        if self._connection is None:
+            create_directories(self._objects_dir)
+
+            self._connection = _connect(os.path.join(self._store_dir, INDEX_FILE_NAME))
+            self._connection.execute("CREATE TABLE IF NOT EXISTS entries ("
+                                     "key TEXT PRIMARY KEY, "
+                                     "object_name TEXT NOT NULL, "
+                                     "size INTEGER NOT NULL, "
+                                     "checksum TEXT NOT NULL, "
+                                     "last_access REAL NOT NULL)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS counters ("
+                                     "name TEXT PRIMARY KEY, "
+                                     "value INTEGER NOT NULL)")
+            self._connection.commit()
+
+        return self._connection
+
+    def get_entry(self, key):
+        """
+        Get path to the file stored under key. Entries whose file is missing or has the wrong size are removed
+
+        Parameters
+        ----------
+        key: string
+            Key of the entry
+
+        Returns
+        -------
+        string
+            Path to the stored file, None if not in store
+
+        """
+        connection = self._get_connection()
+
+        row = connection.execute("SELECT object_name, size FROM entries WHERE key=?", (key,)).fetchone()
+
+        if row is not None:
+            object_name, size = row
+            result_file_path = os.path.join(self._objects_dir, object_name)
+
+            if not self._has_size(result_file_path, size):
+                logging.debug("cache FAIL: %s" % key)
+                self._remove(connection, key, object_name)
+                connection.commit()
+                row = None
+
+        if row is None:
+            logging.debug("cache MISS: %s" % key)
+            self._record_access(connection, counter="misses")
+            return None
+
+        self._record_access(connection, key, "hits")
+
+        logging.debug("cache HIT: %s" % key)
+        return result_file_path
+
+    def _record_access(self, connection, key=None, counter=None):
+
+        if self._access_log.record(key, counter):
+            self._access_log.flush(connection)
+            connection.commit()
+
+    def contains(self, key):
+        """
+        Check if key is in store without counting a hit or miss
+
+        Parameters
+        ----------
+        key: string
+            Key of the entry
+
+        Returns
+        -------
+        bool
+            True if key is in store
+
+        """
+        connection = self._get_connection()
+        row = connection.execute("SELECT 1 FROM entries WHERE key=?", (key,)).fetchone()
+
+        return row is not None
+
+    def cache(self, src_path, key):
+        """
+        Store a copy of a file under key and evict least recently used entries if the byte budget is exceeded
+
+        Parameters
+        ----------
+        src_path: string
+            Path to the file to store
+        key: string
+            Key of the entry
+
+        """
+        connection = self._get_connection()
+
+        object_name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        object_path = os.path.join(self._objects_dir, object_name)
+        temp_path = os.path.join(self._objects_dir, ".tmp-%s" % uuid.uuid4())
+
+        try:
+            checksum = _copy_with_checksum(src_path, temp_path)
+            size = os.path.getsize(temp_path)
+
+            logging.debug("CACHING: %s" % key)
+            os.rename(temp_path, object_path)
+
+        except (IOError, OSError):
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        connection.execute("INSERT OR REPLACE INTO entries (key, object_name, size, checksum, last_access) "
+                           "VALUES (?, ?, ?, ?, ?)", (key, object_name, size, checksum, time.time()))
+
+        # eviction orders by access time, so it has to be up to date
+        self._access_log.flush(connection)
+        self._evict(connection, keep=key)
+        connection.commit()
+
+    def remove(self, key):
+        """
+        Remove entry from store
+
+        Parameters
+        ----------
+        key: string
+            Key of the entry
+
+        """
+        connection = self._get_connection()
+
+        row = connection.execute("SELECT object_name FROM entries WHERE key=?", (key,)).fetchone()
+
+        if row is not None:
+            self._remove(connection, key, row[0])
+            connection.commit()
+
+    def remove_matching(self, key_pattern):
+        """
+        Remove all entries with keys matching a pattern
+
+        Parameters
+        ----------
+        key_pattern: string
+            Unix shell style pattern (SQLite GLOB), e.g. "samr21-xpro/*"
+
+        Returns
+        -------
+        int
+            Number of removed entries
+
+        """
+        connection = self._get_connection()
+
+        rows = connection.execute("SELECT key, object_name FROM entries WHERE key GLOB ?", (key_pattern,)).fetchall()
+
+        for key, object_name in rows:
+            logging.debug("cache REMOVE: %s" % key)
+            self._remove(connection, key, object_name)
+
+        connection.commit()
+
+        return len(rows)
+
+    def get_statistics(self):
+        """
+        Get hit, miss and eviction counters together with the current size of the store
+
+        Returns
+        -------
+        dict
+            Counters by name
+
+        """
+        connection = self._get_connection()
+
+        self._access_log.flush(connection)
+        connection.commit()
+
+        statistics = {"hits": 0, "misses": 0, "evictions": 0}
+        for name, value in connection.execute("SELECT name, value FROM counters"):
+            statistics[name] = value
+
+        entry_count, size = connection.execute("SELECT COUNT(*), TOTAL(size) FROM entries").fetchone()
+        statistics["entries"] = entry_count
+        statistics["size"] = int(size)
+
+        return statistics
+
+    def repair(self):
+        """
+        Verify checksums of all entries and remove corrupt ones. Files in the store which do not belong to an entry,
+        e.g. left over by interrupted cache calls or an older layout of the store, are removed as well
+
+        Returns
+        -------
+        int
+            Number of removed corrupt entries
+
+        """
+        connection = self._get_connection()
+
+        self._access_log.flush(connection)
+        connection.commit()
+
+        object_names = set()
+        corrupt_count = 0
+
+        for key, object_name, checksum in connection.execute("SELECT key, object_name, checksum "
+                                                             "FROM entries").fetchall():
+
+            if self._is_valid(os.path.join(self._objects_dir, object_name), checksum):
+                object_names.add(object_name)
+                continue
+
+            logging.debug("cache FAIL: %s" % key)
+            self._remove(connection, key, object_name)
+            corrupt_count += 1
+
+        connection.commit()
+
+        for name in os.listdir(self._objects_dir):
+            if name not in object_names:
+                self._remove_stale(os.path.join(self._objects_dir, name))
+
+        for name in os.listdir(self._store_dir):
+            if name != OBJECTS_DIR_NAME and not name.startswith(INDEX_FILE_NAME):
+                self._remove_stale(os.path.join(self._store_dir, name))
+
+        return corrupt_count
+
+    @staticmethod
+    def _remove_stale(path):
+
+        try:
+            if time.time() - os.path.getmtime(path) < REPAIR_MIN_AGE:
+                return
+
+            logging.debug("cache REMOVE: %s" % path)
+
+            if os.path.isdir(path):
+                rmtree(path)
+
+            else:
+                os.remove(path)
+
+        except OSError as e:
+            logging.debug(str(e))
+
+    def _evict(self, connection, keep=None):
+        """
+        Remove least recently used entries until the store fits into its byte budget
+
+        """
+        total_size = connection.execute("SELECT TOTAL(size) FROM entries").fetchone()[0]
+
+        if total_size <= self._max_size:
+            return
+
+        candidates = connection.execute("SELECT key, object_name, size FROM entries ORDER BY last_access").fetchall()
+
+        for key, object_name, size in candidates:
+
+            if total_size <= self._max_size:
+                break
+
+            if key == keep:
+                continue
+
+            logging.debug("cache EVICT: %s" % key)
+            self._remove(connection, key, object_name)
+            self._increment(connection, "evictions")
+            total_size -= size
+
+    def _remove(self, connection, key, object_name):
+
+        connection.execute("DELETE FROM entries WHERE key=?", (key,))
+
+        try:
+            os.remove(os.path.join(self._objects_dir, object_name))
+
+        except OSError as e:
+            logging.debug(str(e))
+
+    @staticmethod
+    def _has_size(path, size):
+
+        try:
+            return os.path.getsize(path) == size
+
+        except OSError:
+            return False
+
+    @staticmethod
+    def _is_valid(path, checksum):
+
+        try:
+            return get_checksum(path) == checksum
+
+        except (IOError, OSError):
+            return False
+
+    @staticmethod
+    def _increment(connection, name):
+
+        connection.execute("INSERT OR IGNORE INTO counters (name, value) VALUES (?, 0)", (name,))
+        connection.execute("UPDATE counters SET value=value+1 WHERE name=?", (name,))
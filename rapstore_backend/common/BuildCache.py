@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+ * Copyright (C) 2017 Hendrik van Essen
+ *
+ * This file is subject to the terms and conditions of the GNU Lesser
+ * General Public License v2.1. See the file LICENSE in the top level
+ * directory for more details.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+
+# append root of the python code tree to sys.apth so that imports are working
+#   alternative: add path to rapstore_backend to the PYTHONPATH environment variable, but this includes one more step
+#   which could be forget
+CUR_DIR = os.path.abspath(os.path.dirname(__file__))
+PROJECT_ROOT_DIR = os.path.normpath(os.path.join(CUR_DIR, os.pardir, os.pardir))
+sys.path.append(PROJECT_ROOT_DIR)
+
+from ArtifactStore import ArtifactStore
+
+METADATA_FILE_NAME = "metadata.json"
+
+
+def get_build_cache_key(board, module_names, main_file_content, riot_revision, archive_format):
+    """
+    Get content based key of a custom build
+
+    Parameters
+    ----------
+    board: string
+        Board name
+    module_names: array_like with string
+        Names of the used modules, order does not matter
+    main_file_content: bytes
+        Content of the main.c file
+    riot_revision: string
+        Commit hash of the RIOT repository
+    archive_format: string
+        Compression and level of the archive
+
+    Returns
+    -------
+    string
+        Hex digest identifying the build
+
+    """
+    sha = hashlib.sha256()
+
+    for part in [riot_revision, archive_format, board] + sorted(module_names):
+        sha.update(_to_bytes(part))
+        sha.update(b"\0")
+
+    sha.update(_to_bytes(main_file_content))
+
+    return sha.hexdigest()
+
+
+def _to_bytes(value):
+
+    if isinstance(value, bytes):
+        return value
+
+    return value.encode("utf-8")
+
+
+class BuildCache(object):
+    """
+    Content addressed cache for custom builds, stored in an ArtifactStore. Every entry consists of several files,
+    stored under "<key>/<file name>", and a metadata file. The metadata is stored last, so an entry with metadata was
+    stored completely. Files of an entry may still be evicted separately, a lookup has to check every file it needs
+
+    """
+
+    _store = None
+
+    def __init__(self, cache_dir, max_size):
+        self._store = ArtifactStore(cache_dir, max_size)
+
+    def get_entry(self, key, file_name):
+
+        return self._store.get_entry(_get_key(key, file_name))
+
+    def get_metadata(self, key):
+        """
+        Get metadata of a cache entry and mark it as recently used
+
+        Parameters
+        ----------
+        key: string
+            Key of the entry
+
+        Returns
+        -------
+        dict
+            Metadata stored with the entry, None if not in cache
+
+        """
+        metadata_path = self._store.get_entry(_get_key(key, METADATA_FILE_NAME))
+
+        if metadata_path is None:
+            return None
+
+        try:
+            with open(metadata_path) as metadata_file:
+                return json.load(metadata_file)
+
+        except (IOError, OSError, ValueError) as e:
+            # entry got evicted in the meantime
+            logging.debug(str(e))
+            return None
+
+    def cache(self, key, src_paths, metadata):
+        """
+        Store files and metadata as one entry. Files of the entry which are in cache already are replaced
+
+        Parameters
+        ----------
+        key: string
+            Key of the entry
+        src_paths: array_like with string
+            Files to store, their base names are used as names within the entry
+        metadata: dict
+            JSON serializable metadata of the entry
+
+        """
+        for src_path in src_paths:
+            self._store.cache(src_path, _get_key(key, os.path.basename(src_path)))
+
+        metadata_fd, metadata_path = tempfile.mkstemp(suffix=".json")
+
+        try:
+            with os.fdopen(metadata_fd, "w") as metadata_file:
+                json.dump(metadata, metadata_file)
+
+            self._store.cache(metadata_path, _get_key(key, METADATA_FILE_NAME))
+
+        finally:
+            os.remove(metadata_path)
+
+    def repair(self):
+
+        return self._store.repair()
+
+    def get_statistics(self):
+
+        return self._store.get_statistics()
+
+
+def _get_key(key, file_name):
+
+    return "/".join((key, file_name))
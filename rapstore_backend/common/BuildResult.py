@@ -9,6 +9,19 @@
  * directory for more details.
 """
 
+from __future__ import print_function
+
+import json
+import os
+import sys
+from shutil import copyfileobj
+
+OUTPUT_DICT = 'dict'
+OUTPUT_JSON = 'json'
+OUTPUT_STREAM = 'stream'
+
+OUTPUTS = (OUTPUT_DICT, OUTPUT_JSON, OUTPUT_STREAM)
+
 
 def get_build_result_template():
 
@@ -17,7 +30,94 @@ def get_build_result_template():
         'board': None,
         'application_name': 'application',
         'output_archive': None,
+        'output_archive_path': None,
         'success': False
     }
 
     return build_result
+
+
+def build_result_to_json(build_result):
+    """
+    Serialize a build result to JSON
+
+    Parameters
+    ----------
+    build_result: dict
+        Build result to serialize. Byte strings (e.g. output of make) are decoded as UTF-8
+
+    Returns
+    -------
+    string
+        JSON representation of the build result
+
+    """
+    serializable = {}
+
+    for key, value in build_result.items():
+        if isinstance(value, bytes):
+            value = value.decode('utf-8', 'replace')
+
+        serializable[key] = value
+
+    return json.dumps(serializable)
+
+
+def write_build_result(build_result, file_obj, stream_archive=False):
+    """
+    Write a build result as one line of JSON. If stream_archive is set, the archive referenced by output_archive_path
+    follows as raw bytes, its length is given as output_archive_size. The streamed archive file is removed afterwards
+
+    Parameters
+    ----------
+    build_result: dict
+        Build result to write
+    file_obj: file
+        Binary file object to write to
+    stream_archive: bool (default =False)
+        Whether to append the archive as raw bytes
+
+    """
+    archive_path = build_result.get('output_archive_path')
+
+    if not stream_archive or archive_path is None:
+        file_obj.write((build_result_to_json(build_result) + '\n').encode('utf-8'))
+        file_obj.flush()
+        return
+
+    try:
+        with open(archive_path, 'rb') as archive_file:
+            build_result['output_archive_size'] = os.fstat(archive_file.fileno()).st_size
+            build_result['output_archive_path'] = None
+
+            file_obj.write((build_result_to_json(build_result) + '\n').encode('utf-8'))
+            copyfileobj(archive_file, file_obj)
+
+        file_obj.flush()
+
+    finally:
+        os.remove(archive_path)
+
+
+def print_build_result(build_result, output=OUTPUT_DICT):
+    """
+    Print a build result to stdout
+
+    Parameters
+    ----------
+    build_result: dict
+        Build result to print
+    output: string (default =OUTPUT_DICT)
+        One of OUTPUTS. OUTPUT_DICT prints the python representation, OUTPUT_JSON one line of JSON and OUTPUT_STREAM
+        one line of JSON followed by the raw archive, see write_build_result
+
+    """
+    if output == OUTPUT_DICT:
+        print(build_result)
+
+    else:
+        sys.stdout.flush()
+
+        # python 3 needs the underlying binary buffer to write raw bytes
+        stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+        write_build_result(build_result, stdout, output == OUTPUT_STREAM)
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+ * Copyright (C) 2017 Hendrik van Essen
+ *
+ * This file is subject to the terms and conditions of the GNU Lesser
+ * General Public License v2.1. See the file LICENSE in the top level
+ * directory for more details.
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+import uuid
+
+# append root of the python code tree to sys.apth so that imports are working
+#   alternative: add path to rapstore_backend to the PYTHONPATH environment variable, but this includes one more step
+#   which could be forget
+CUR_DIR = os.path.abspath(os.path.dirname(__file__))
+PROJECT_ROOT_DIR = os.path.normpath(os.path.join(CUR_DIR, os.pardir, os.pardir))
+sys.path.append(PROJECT_ROOT_DIR)
+
+from common import get_database_version
+
+
+class MetadataCache(object):
+    """
+    Read-through cache of the tables "applications", "modules" and "boards". The tables are loaded into memory at once
+    on first use, from a snapshot file if it matches the current database version, otherwise from the database. After
+    db_update.py changed the database version, the tables are loaded again. As long as there is no database version,
+    changes can not be noticed, so every lookup queries the database
+
+    Methods
+    -------
+    get_application(db, application_id)
+        Get name and path of an application
+    get_module_names(db, module_ids)
+        Get names of several modules
+    get_board(db, internal_name)
+        Get a board by its internal name
+
+    """
+
+    _version_file = None
+    _snapshot_file = None
+    _version = None
+    _tables = None
+    _lock = None
+
+    def __init__(self, version_file, snapshot_file=None):
+        self._version_file = version_file
+        self._snapshot_file = snapshot_file
+        self._lock = threading.Lock()
+
+    def get_application(self, db, application_id):
+        """
+        Get name and path of an application
+
+        Parameters
+        ----------
+        db: MyDatabase
+            Database to load the tables from if needed
+        application_id: int
+            ID of the application
+
+        Returns
+        -------
+        dict
+            Application with keys "name" and "path", None if not found
+
+        """
+        tables = self._get_tables(db)
+
+        if tables is None:
+            application = _fetch_application(db, application_id)
+
+        else:
+            application = tables["applications"].get(int(application_id))
+
+        if application is None:
+            logging.error("unknown application ID: %s" % application_id)
+
+        return application
+
+    def get_module_names(self, db, module_ids):
+        """
+        Get names of modules
+
+        Parameters
+        ----------
+        db: MyDatabase
+            Database to load the tables from if needed
+        module_ids: array_like with int
+            IDs of the modules
+
+        Returns
+        -------
+        array_like
+            Module names in order of module_ids, None if an ID is unknown
+
+        """
+        tables = self._get_tables(db)
+
+        if tables is None:
+            modules = _fetch_modules(db, module_ids)
+
+        else:
+            modules = tables["modules"]
+
+        unknown_ids = [module_id for module_id in module_ids if int(module_id) not in modules]
+
+        if unknown_ids:
+            logging.error("unknown module IDs: %s" % unknown_ids)
+            return None
+
+        return [modules[int(module_id)]["name"] for module_id in module_ids]
+
+    def get_board(self, db, internal_name):
+        """
+        Get a board by its internal name
+
+        Parameters
+        ----------
+        db: MyDatabase
+            Database to load the tables from if needed
+        internal_name: string
+            Internal name of the board, e.g. "samr21-xpro"
+
+        Returns
+        -------
+        dict
+            Board with keys "id", "display_name" and "flash_program", None if not found
+
+        """
+        tables = self._get_tables(db)
+
+        if tables is None:
+            return _fetch_board(db, internal_name)
+
+        return tables["boards"].get(internal_name)
+
+    def _get_tables(self, db):
+        """
+        Get tables of the current database version, load them if necessary. None if there is no database version
+
+        """
+        version = get_database_version(self._version_file)
+
+        if version is None:
+            return None
+
+        with self._lock:
+            if self._tables is None or version != self._version:
+                tables = self._load_snapshot(version)
+
+                if tables is None:
+                    tables = _fetch_tables(db)
+                    self._write_snapshot(version, tables)
+
+                self._tables = tables
+                self._version = version
+
+            return self._tables
+
+    def _load_snapshot(self, version):
+
+        if self._snapshot_file is None:
+            return None
+
+        try:
+            with open(self._snapshot_file) as snapshot_file:
+                snapshot = json.load(snapshot_file)
+
+        except (IOError, ValueError):
+            return None
+
+        if snapshot.get("version") != version:
+            return None
+
+        logging.debug("metadata loaded from snapshot, version %s" % version)
+        return _tables_from_rows(snapshot["applications"], snapshot["modules"], snapshot["boards"])
+
+    def _write_snapshot(self, version, tables):
+
+        if self._snapshot_file is None:
+            return
+
+        snapshot = {
+            "version": version,
+            "applications": [[id, app["name"], app["path"]] for id, app in tables["applications"].items()],
+            "modules": [[id, module["name"], module["path"]] for id, module in tables["modules"].items()],
+            "boards": [[board["id"], board["display_name"], internal_name, board["flash_program"]]
+                       for internal_name, board in tables["boards"].items()]
+        }
+
+        temp_path = "%s.tmp-%s" % (self._snapshot_file, uuid.uuid4())
+
+        try:
+            with open(temp_path, "w") as snapshot_file:
+                json.dump(snapshot, snapshot_file)
+
+            os.rename(temp_path, self._snapshot_file)
+
+        except (IOError, OSError) as e:
+            logging.debug(str(e))
+
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+
+def _fetch_tables(db):
+
+    db.query("SELECT id, name, path FROM applications")
+    applications = [(row["id"], row["name"], row["path"]) for row in db.fetchall()]
+
+    db.query("SELECT id, name, path FROM modules")
+    modules = [(row["id"], row["name"], row["path"]) for row in db.fetchall()]
+
+    db.query("SELECT id, display_name, internal_name, flash_program FROM boards")
+    boards = [(row["id"], row["display_name"], row["internal_name"], row["flash_program"]) for row in db.fetchall()]
+
+    logging.debug("metadata loaded from database")
+    return _tables_from_rows(applications, modules, boards)
+
+
+def _fetch_application(db, application_id):
+
+    db.query("SELECT name, path FROM applications WHERE id=%s", (int(application_id),))
+    rows = db.fetchall()
+
+    if not rows:
+        return None
+
+    return {"name": rows[0]["name"], "path": rows[0]["path"]}
+
+
+def _fetch_modules(db, module_ids):
+
+    module_ids = sorted(set(int(module_id) for module_id in module_ids))
+
+    if not module_ids:
+        return {}
+
+    db.query("SELECT id, name, path FROM modules WHERE id IN (%s)" % ", ".join(["%s"] * len(module_ids)),
+             tuple(module_ids))
+
+    return dict((int(row["id"]), {"name": row["name"], "path": row["path"]}) for row in db.fetchall())
+
+
+def _fetch_board(db, internal_name):
+
+    db.query("SELECT id, display_name, flash_program FROM boards WHERE internal_name=%s", (internal_name,))
+    rows = db.fetchall()
+
+    if not rows:
+        return None
+
+    return {"id": int(rows[0]["id"]), "display_name": rows[0]["display_name"],
+            "flash_program": rows[0]["flash_program"]}
+
+
+def _tables_from_rows(applications, modules, boards):
+
+    return {
+        "applications": dict((int(id), {"name": name, "path": path}) for id, name, path in applications),
+        "modules": dict((int(id), {"name": name, "path": path}) for id, name, path in modules),
+        "boards": dict((internal_name, {"id": int(id), "display_name": display_name, "flash_program": flash_program})
+                       for id, display_name, internal_name, flash_program in boards)
+    }
@@ -10,9 +10,12 @@
 """
 
 import MySQLdb
+import MySQLdb.cursors
 
+import logging
 import os
 import sys
+import threading
 
 # append root of the python code tree to sys.apth so that imports are working
 #   alternative: add path to rapstore_backend to the PYTHONPATH environment variable, but this includes one more step
@@ -23,29 +26,251 @@ sys.path.append(PROJECT_ROOT_DIR)
 
 from rapstore_backend.config import config
 
+# MySQL client errors of a connection which has been closed by the server, e.g. after wait_timeout
+CR_SERVER_GONE_ERROR = 2006
+CR_SERVER_LOST = 2013
+
+# statements which do not change data, repeating them on a new connection is safe outside of an explicit transaction
+READ_STATEMENTS = ("SELECT", "SHOW", "DESCRIBE", "EXPLAIN")
+
+
+class ConnectionPool(object):
+    """
+    Pool of idle database connections, shared by all MyDatabase objects of a process
+
+    """
+
+    _max_idle = None
+    _idle_connections = None
+    _lock = None
+
+    def __init__(self, max_idle):
+        self._max_idle = max_idle
+        self._idle_connections = []
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        Get an idle connection or open a new one
+
+        """
+        with self._lock:
+            if self._idle_connections:
+                return self._idle_connections.pop()
+
+        return self.connect()
+
+    @staticmethod
+    def connect():
+        """
+        Open a new connection
+
+        """
+        return MySQLdb.connect(config.db_config["host"],
+                               config.db_config["user"],
+                               config.db_config["passwd"],
+                               config.db_config["db"])
+
+    def put(self, connection):
+        """
+        Return a connection to the pool. It is closed if enough connections are idle already
+
+        """
+        with self._lock:
+            if len(self._idle_connections) < self._max_idle:
+                self._idle_connections.append(connection)
+                return
+
+        _close_quietly(connection)
+
+
+_pool = ConnectionPool(config.DATABASE_POOL_SIZE)
+
+
+def _close_quietly(connection):
+
+    try:
+        connection.close()
+
+    except MySQLdb.Error as e:
+        logging.debug(str(e))
+
+
+def _release(connection):
+    """
+    Roll back uncommitted changes and return a connection to the pool
+
+    """
+    try:
+        connection.rollback()
+
+    except MySQLdb.Error as e:
+        # broken connections are not pooled again
+        logging.debug(str(e))
+        _close_quietly(connection)
+        return
+
+    _pool.put(connection)
+
 
 class MyDatabase(object):
+    """
+    Database access with one connection per thread. The connection is taken from a process wide pool on the first
+    query, so creating a MyDatabase object is cheap, and goes back to the pool with close(). Used as context manager,
+    changes are committed (or rolled back on an exception) and the connection is released at the end of the block
+
+        with MyDatabase() as db:
+            db.query("SELECT ...")
 
-    _db_connection = None
-    _db_cursor = None
+    If the connection was closed by the server, e.g. an idle pooled one, a new one is opened and the query is repeated
+    once. This is only done as long as nothing was written since the last commit and no transaction was started with
+    begin(), otherwise the error is raised
+
+    """
+
+    _local = None
+    _connections = None
+    _connections_lock = None
 
     def __init__(self):
-        self._db_connection = MySQLdb.connect(config.db_config["host"],
-                                              config.db_config["user"],
-                                              config.db_config["passwd"],
-                                              config.db_config["db"])
+        self._local = threading.local()
 
-        self._db_cursor = self._db_connection.cursor(cursorclass=MySQLdb.cursors.DictCursor)
+        # connections of all threads, so they can be released when the object goes away
+        self._connections = set()
+        self._connections_lock = threading.Lock()
 
     def __del__(self):
-        self._db_cursor.close()
-        self._db_connection.close()
+
+        try:
+            with self._connections_lock:
+                connections = list(self._connections)
+                self._connections.clear()
+
+            for connection in connections:
+                _release(connection)
+
+        except Exception:
+            # pool or MySQLdb may be gone already while the interpreter shuts down
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        if self._get_connection(connect=False) is not None:
+            if exc_type is None:
+                self.commit()
+
+            else:
+                self.rollback()
+
+        self.close()
 
     def query(self, query, params=None):
-        return self._db_cursor.execute(query, params)
+        return self._execute("execute", query, params)
+
+    def executemany(self, query, params_list):
+        return self._execute("executemany", query, params_list)
 
     def fetchall(self):
-        return self._db_cursor.fetchall()
+        return self._get_cursor().fetchall()
+
+    def begin(self):
+        """
+        Start a transaction explicitly. Also reads within it are not repeated on a new connection, so they all see the
+        same snapshot
+
+        """
+        self.query("START TRANSACTION")
+        self._local.in_transaction = True
 
     def commit(self):
-        return self._db_connection.commit()
+        self._get_connection().commit()
+        self._local.in_transaction = False
+
+    def rollback(self):
+        self._get_connection().rollback()
+        self._local.in_transaction = False
+
+    def close(self):
+        """
+        Release the connection of the current thread to the pool. Uncommitted changes are rolled back
+
+        """
+        connection = self._get_connection(connect=False)
+
+        if connection is None:
+            return
+
+        self._local.cursor.close()
+        self._local.connection = None
+        self._local.cursor = None
+        self._local.in_transaction = False
+
+        self._forget_connection(connection)
+        _release(connection)
+
+    def _execute(self, method_name, query, params):
+
+        cursor = self._get_cursor()
+        in_transaction = self._local.in_transaction
+
+        try:
+            result = getattr(cursor, method_name)(query, params)
+
+        except MySQLdb.OperationalError as e:
+            if in_transaction or e.args[0] not in (CR_SERVER_GONE_ERROR, CR_SERVER_LOST):
+                raise
+
+            logging.debug("reconnecting: %s" % str(e))
+            self._discard_connection()
+
+            # other idle connections of the pool are likely to be closed as well, so open a new one
+            self._set_connection(ConnectionPool.connect())
+
+            result = getattr(self._get_cursor(), method_name)(query, params)
+
+        if not query.lstrip().upper().startswith(READ_STATEMENTS):
+            self._local.in_transaction = True
+
+        return result
+
+    def _get_connection(self, connect=True):
+
+        connection = getattr(self._local, "connection", None)
+
+        if connection is None and connect:
+            connection = _pool.get()
+            self._set_connection(connection)
+
+        return connection
+
+    def _set_connection(self, connection):
+
+        self._local.connection = connection
+        self._local.cursor = connection.cursor(cursorclass=MySQLdb.cursors.DictCursor)
+        self._local.in_transaction = False
+
+        with self._connections_lock:
+            self._connections.add(connection)
+
+    def _forget_connection(self, connection):
+
+        with self._connections_lock:
+            self._connections.discard(connection)
+
+    def _get_cursor(self):
+
+        self._get_connection()
+        return self._local.cursor
+
+    def _discard_connection(self):
+
+        connection = self._get_connection(connect=False)
+
+        if connection is not None:
+            self._local.connection = None
+            self._local.cursor = None
+            self._forget_connection(connection)
+            _close_quietly(connection)
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+ * Copyright (C) 2017 Hendrik van Essen
+ *
+ * This file is subject to the terms and conditions of the GNU Lesser
+ * General Public License v2.1. See the file LICENSE in the top level
+ * directory for more details.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import sys
+
+# append root of the python code tree to sys.apth so that imports are working
+#   alternative: add path to rapstore_backend to the PYTHONPATH environment variable, but this includes one more step
+#   which could be forget
+CUR_DIR = os.path.abspath(os.path.dirname(__file__))
+PROJECT_ROOT_DIR = os.path.normpath(os.path.join(CUR_DIR, os.pardir, os.pardir))
+sys.path.append(PROJECT_ROOT_DIR)
+
+from common import create_directories
+
+
+def get_file_states(paths):
+    """
+    Get modification time and size of files
+
+    Parameters
+    ----------
+    paths: array_like with string
+        Paths to the files
+
+    Returns
+    -------
+    array_like
+        [path, mtime, size] for every existing file
+
+    """
+    states = []
+
+    for path in paths:
+        try:
+            stat = os.stat(path)
+
+        except OSError:
+            continue
+
+        states.append([path, stat.st_mtime, stat.st_size])
+
+    return states
+
+
+def get_file_hashes(paths):
+    """
+    Get SHA-1 hashes of files
+
+    Parameters
+    ----------
+    paths: array_like with string
+        Paths to the files
+
+    Returns
+    -------
+    array_like
+        [path, hash] for every existing file
+
+    """
+    hashes = []
+
+    for path in paths:
+        try:
+            with open(path, "rb") as file:
+                hashes.append([path, hashlib.sha1(file.read()).hexdigest()])
+
+        except IOError:
+            continue
+
+    return hashes
+
+
+class SourceIndex(object):
+    """
+    Persistent index of values extracted from source files, e.g. name and description of a module. Every entry stores
+    modification time, size and hash of the files it was extracted from. An entry is still valid if all files have
+    the same modification time and size, or if only the modification time changed but the content is the same, e.g.
+    after a checkout of another revision
+
+    """
+
+    _index_path = None
+
+    def __init__(self, index_path):
+        self._index_path = index_path
+
+    def _connect(self):
+
+        create_directories(os.path.dirname(self._index_path))
+
+        connection = sqlite3.connect(self._index_path, timeout=60)
+        connection.execute("CREATE TABLE IF NOT EXISTS entries ("
+                           "key TEXT PRIMARY KEY, "
+                           "file_states TEXT NOT NULL, "
+                           "file_hashes TEXT NOT NULL, "
+                           "value TEXT NOT NULL)")
+
+        return connection
+
+    def load(self):
+        """
+        Load all entries
+
+        Returns
+        -------
+        dict
+            Entries by key, each a dict with keys "file_states", "file_hashes" and "value"
+
+        """
+        connection = self._connect()
+
+        try:
+            rows = connection.execute("SELECT key, file_states, file_hashes, value FROM entries").fetchall()
+
+        finally:
+            connection.close()
+
+        entries = {}
+
+        for key, file_states, file_hashes, value in rows:
+            entries[key] = {
+                "file_states": json.loads(file_states),
+                "file_hashes": json.loads(file_hashes),
+                "value": json.loads(value)
+            }
+
+        return entries
+
+    def store(self, entries):
+        """
+        Replace all entries of the index
+
+        Parameters
+        ----------
+        entries: dict
+            Entries by key, see load
+
+        """
+        rows = [(key, json.dumps(entry["file_states"]), json.dumps(entry["file_hashes"]), json.dumps(entry["value"]))
+                for key, entry in entries.items()]
+
+        connection = self._connect()
+
+        try:
+            connection.execute("DELETE FROM entries")
+            connection.executemany("INSERT INTO entries (key, file_states, file_hashes, value) VALUES (?, ?, ?, ?)",
+                                   rows)
+            connection.commit()
+
+        finally:
+            connection.close()
+
+        logging.debug("source index stored: %d entries" % len(rows))
+
+    @staticmethod
+    def lookup(entry, paths):
+        """
+        Get the indexed value if the files it was extracted from did not change
+
+        Parameters
+        ----------
+        entry: dict
+            Indexed entry, see load. May be None
+        paths: array_like with string
+            Files the value is extracted from, missing files are allowed
+
+        Returns
+        -------
+        tuple
+            Value (None if it has to be extracted again) and the entry to index for the current files without its
+            value, so extracting does not need to read the files states again
+
+        """
+        file_states = get_file_states(paths)
+
+        if entry is not None and _normalize(entry["file_states"]) == _normalize(file_states):
+            return entry["value"], {"file_states": file_states, "file_hashes": entry["file_hashes"]}
+
+        file_hashes = get_file_hashes([state[0] for state in file_states])
+
+        if entry is not None and _normalize(entry["file_hashes"]) == _normalize(file_hashes):
+            return entry["value"], {"file_states": file_states, "file_hashes": file_hashes}
+
+        return None, {"file_states": file_states, "file_hashes": file_hashes}
+
+
+def _normalize(items):
+    """Make lists of lists loaded from JSON and freshly created ones comparable."""
+    return [tuple(item) for item in items]
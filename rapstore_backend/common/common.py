@@ -11,6 +11,7 @@
 
 import errno
 import os
+import uuid
 
 
 def create_directories(path):
@@ -34,4 +35,46 @@ def create_directories(path):
     except OSError as e:
 
         if e.errno != errno.EEXIST:
-            raise
\ No newline at end of file
+            raise
+
+
+def get_database_version(path):
+    """
+    Get version of the database content, see update_database_version
+
+    Parameters
+    ----------
+    path: string
+        Path to the version file
+
+    Returns
+    -------
+    string
+        Version, None if the version file does not exist
+
+    """
+    try:
+        with open(path) as version_file:
+            return version_file.read().strip()
+
+    except IOError:
+        return None
+
+
+def update_database_version(path):
+    """
+    Write a new version of the database content. Has to be called after the tables were changed, so processes caching
+    database content drop their caches
+
+    Parameters
+    ----------
+    path: string
+        Path to the version file
+
+    """
+    temp_path = "%s.tmp-%s" % (path, uuid.uuid4())
+
+    with open(temp_path, "w") as version_file:
+        version_file.write(str(uuid.uuid4()))
+
+    os.rename(temp_path, path)
@@ -28,8 +28,64 @@ application_directories = [
     "examples"
 ]
 
+# maximum number of idle database connections kept open per process
+DATABASE_POOL_SIZE = 4
+
 LOGGING_FORMAT = "[%(levelname)s]: %(asctime)s\n"\
                  + "in %(filename)s in %(funcName)s on line %(lineno)d\n"\
                  + "%(message)s\n\n"
 
 APPLICATION_CACHE_DIR = ".application_cache"
+APPLICATION_CACHE_MAX_SIZE = 4 * 1024 * 1024 * 1024
+
+BUILD_SERVER_SOCKET = "tmp/build_server.sock"
+BUILD_SERVER_MAX_JOBS = 4
+# directory clients may ask the build server to place archives in besides tmp/, None to only allow tmp/
+BUILD_SERVER_ARCHIVE_DIR = None
+
+BUILD_CACHE_DIR = ".build_cache"
+BUILD_CACHE_MAX_SIZE = 1024 * 1024 * 1024
+
+# reuse pre-built archives of the stripped repository per board and only append the application to them
+USE_BASE_ARCHIVES = True
+
+# compression of archives returned to the user: "none", "gz", "xz" (needs lzma) or "zst" (needs zstandard)
+ARCHIVE_COMPRESSION = "gz"
+# None for the default level of the compression
+ARCHIVE_COMPRESSION_LEVEL = None
+
+# written by db_update.py after reloading the tables, processes caching database content drop their caches if it changes
+DATABASE_VERSION_FILE = ".database_version"
+
+# snapshot of the applications, modules and boards tables, loaded instead of querying them
+METADATA_SNAPSHOT_FILE = ".metadata_snapshot.json"
+
+# modification times, hashes and extracted names and descriptions of module and application sources used by db_update.py
+SOURCE_INDEX_FILE = ".source_index.sqlite"
+
+# state of the build tasks of prepare_all.py, an interrupted run is resumed from it
+BUILD_JOB_QUEUE_FILE = ".prepare_all_queue.sqlite"
+
+# boards built first by prepare_all.py, most important first
+PREPARE_ALL_PRIORITY_BOARDS = ["samr21-xpro", "iotlab-m3"]
+
+# "fixed": always run PREPARE_ALL_MAX_BUILDS builds in prepare_all.py
+# "adaptive": start with half of them and add or remove builds depending on load average and free memory
+PREPARE_ALL_SCHEDULING_POLICY = "adaptive"
+# None for the number of CPUs
+PREPARE_ALL_MAX_BUILDS = None
+PREPARE_ALL_MAX_MAKE_JOBS = None
+PREPARE_ALL_MAX_LOAD = None
+# available memory in bytes below which builds are removed, None to ignore memory
+PREPARE_ALL_MIN_FREE_MEMORY = 1024 * 1024 * 1024
+
+# compiler output shared by all builds, None to build without ccache. Builds are done in reused directories at the same
+# depth (RIOT/generated_by_rapstore/application<N>), paths are hashed relative to them, and every application is built
+# under the same name, so objects are shared between build directories and applications as long as board and compiler
+# flags match. Run tasks/build/check_ccache.py to see if builds hit the cache
+CCACHE_DIR = ".ccache"
+CCACHE_MAX_SIZE = "5G"
+# compilers run through ccache, covers the toolchains of the RIOT boards
+CCACHE_COMPILERS = ["arm-none-eabi-gcc", "arm-none-eabi-g++", "avr-gcc", "avr-g++", "msp430-gcc", "msp430-g++",
+                    "mips-mti-elf-gcc", "mips-mti-elf-g++", "riscv-none-embed-gcc", "riscv-none-embed-g++", "gcc", "g++",
+                    "clang", "clang++"]
@@ -13,28 +13,34 @@ from __future__ import print_function
 
 import logging
 import os
-from shutil import rmtree
 from subprocess import Popen, PIPE, STDOUT
 
 from config import config
+from config import strip_config
+from utility import build_utility as b_util
+from common.ApplicationCache import ApplicationCache
+from common.BuildCache import BuildCache
 
 CUR_DIR = os.path.abspath(os.path.dirname(__file__))
 PROJECT_ROOT_DIR = os.path.normpath(os.path.join(CUR_DIR, os.pardir))
 
 LOGFILE = os.path.join(PROJECT_ROOT_DIR, "log", "push_webhook_handler.log")
 
+APPLICATION_CACHE_DIR = os.path.join(PROJECT_ROOT_DIR, config.APPLICATION_CACHE_DIR)
+BUILD_CACHE_DIR = os.path.join(PROJECT_ROOT_DIR, config.BUILD_CACHE_DIR)
+
+# database is only recreated if files in here changed
+SETUP_PATH_PREFIX = "rapstore_backend/setup/"
+
 
 def main():
     """
     Routine to update backend repository. Gets called by push_webhook_handler.py inside frontend"""
 
-    """DELETE CACHE"""
-    cache_dir = config.APPLICATION_CACHE_DIR
-    try:
-        rmtree(cache_dir)
+    riot_dir = os.path.join(PROJECT_ROOT_DIR, "RIOT")
 
-    except Exception:
-        pass
+    old_backend_revision = b_util.get_riot_revision(PROJECT_ROOT_DIR)
+    old_riot_revision = b_util.get_riot_revision(riot_dir)
 
     """UPDATE GIT REPOSITORY"""
     output = execute_command(["git", "-C", PROJECT_ROOT_DIR, "pull"])
@@ -43,25 +49,162 @@ def main():
     output = execute_command(["git", "-C", PROJECT_ROOT_DIR, "submodule", "update", "--recursive", "--remote"])
     logging.debug("UPDATE SUBMODULES:\n" + output)
 
+    new_backend_revision = b_util.get_riot_revision(PROJECT_ROOT_DIR)
+    new_riot_revision = b_util.get_riot_revision(riot_dir)
+
+    backend_changes = b_util.get_changed_paths(PROJECT_ROOT_DIR, old_backend_revision, new_backend_revision)
+
     """SETUP DATABASE"""
-    output = execute_command(["python", "db_create.py"], os.path.join(PROJECT_ROOT_DIR, "rapstore_backend", "setup"))
-    logging.debug("DB_CREATE:\n" + output)
+    # recreating the database changes all IDs, so only do it if the table definitions changed
+    if backend_changes is None or any(path.startswith(SETUP_PATH_PREFIX) for path in backend_changes):
+        setup_dir = os.path.join(PROJECT_ROOT_DIR, "rapstore_backend", "setup")
+
+        output = execute_command(["python", "db_create.py"], setup_dir)
+        logging.debug("DB_CREATE:\n" + output)
+
+        output = execute_command(["python", "db_setup.py"], setup_dir)
+        logging.debug("DB_SETUP:\n" + output)
+
+        changes = None
 
-    output = execute_command(["python", "db_setup.py"], os.path.join(PROJECT_ROOT_DIR, "rapstore_backend", "setup"))
-    logging.debug("DB_SETUP:\n" + output)
+    else:
+        changes = get_changes(b_util.get_changed_paths(riot_dir, old_riot_revision, new_riot_revision))
+
+    logging.debug("CHANGES:\n" + str(changes))
 
     """UPDATE DATABASE"""
-    output = execute_command(["python", "db_update.py"], os.path.join(PROJECT_ROOT_DIR, "rapstore_backend", "tasks", "database"))
-    logging.debug("DB_UPDATE:\n" + output)
+    if changes is None or changes["tree"] or changes["applications"]:
+        output = execute_command(["python", "db_update.py"],
+                                 os.path.join(PROJECT_ROOT_DIR, "rapstore_backend", "tasks", "database"))
+        logging.debug("DB_UPDATE:\n" + output)
 
     """CREATE STRIPPED RIOT REPOSITORY"""
-    output = execute_command(["python", "strip_riot_repo.py"], os.path.join(PROJECT_ROOT_DIR, "rapstore_backend"))
-    logging.debug("STRIP_RIOT_REPO.py:\n" + output)
+    if changes is None or changes["tree"]:
+        output = execute_command(["python", "strip_riot_repo.py"], os.path.join(PROJECT_ROOT_DIR, "rapstore_backend"))
+        logging.debug("STRIP_RIOT_REPO.py:\n" + output)
+
+    """INVALIDATE CACHE"""
+    # only after the database and the stripped repository are updated, otherwise builds running in the meantime would
+    # store results of the old state again
+    invalidate_cache(changes)
+
+    """REPAIR CACHES"""
+    repair_caches()
 
     # give calling script from frontend an answer
     print("updated backend successfully")
 
 
+def get_changes(changed_paths):
+    """
+    Determine what is affected by changed files of the RIOT repository
+
+    Parameters
+    ----------
+    changed_paths: array_like with string
+        Changed paths relative to the RIOT repository, None if unknown
+
+    Returns
+    -------
+    dict
+        "all": whether every build is affected, "boards": names of boards whose builds are affected,
+        "applications": directory names of applications whose builds are affected, "tree": whether the stripped
+        repository is affected. None if changed_paths is None
+
+    """
+    if changed_paths is None:
+        return None
+
+    changes = {"all": False, "boards": set(), "applications": set(), "tree": False}
+
+    for path in changed_paths:
+        parts = path.split("/")
+
+        if parts[0] in get_application_directories():
+            # files directly inside of the application directory are not part of an application
+            if len(parts) > 2:
+                changes["applications"].add(parts[1])
+
+            continue
+
+        if is_ignored(parts):
+            continue
+
+        changes["tree"] = True
+
+        if parts[0] == "boards" and len(parts) > 2 and not parts[1] == "common" and not parts[1].endswith("-common"):
+            changes["boards"].add(parts[1])
+
+        else:
+            # everything else, e.g. cpu, sys or common board files, can be used by every build
+            changes["all"] = True
+
+    return changes
+
+
+def get_application_directories():
+
+    # config entries may end with a slash
+    return [directory.strip("/") for directory in config.application_directories]
+
+
+def is_ignored(parts):
+    """
+    Check if a path is excluded from the stripped repository, so it does not affect any build
+
+    Parameters
+    ----------
+    parts: array_like with string
+        Components of the path relative to the RIOT repository
+
+    Returns
+    -------
+    bool
+        True if the path is ignored
+
+    """
+    for i in range(len(parts)):
+        if strip_config.ignore_patterns("/".join(parts[:i]), [parts[i]]):
+            return True
+
+    return False
+
+
+def invalidate_cache(changes):
+    """
+    Remove entries of affected builds from the application cache
+
+    Parameters
+    ----------
+    changes: dict
+        Affected builds, see get_changes. None to remove every entry
+
+    """
+    cache = ApplicationCache(APPLICATION_CACHE_DIR, config.APPLICATION_CACHE_MAX_SIZE)
+
+    if changes is None or changes["all"]:
+        logging.debug("INVALIDATE CACHE: %d entries" % cache.invalidate())
+        return
+
+    for board in changes["boards"]:
+        logging.debug("INVALIDATE CACHE OF %s: %d entries" % (board, cache.invalidate(board=board)))
+
+    for application in changes["applications"]:
+        logging.debug("INVALIDATE CACHE OF %s: %d entries" % (application, cache.invalidate(app_dir_name=application)))
+
+
+def repair_caches():
+    """
+    Remove corrupt entries and left over files from the application and the build cache
+
+    """
+    application_cache = ApplicationCache(APPLICATION_CACHE_DIR, config.APPLICATION_CACHE_MAX_SIZE)
+    logging.debug("REPAIR APPLICATION CACHE: %d corrupt entries" % application_cache.repair())
+
+    build_cache = BuildCache(BUILD_CACHE_DIR, config.BUILD_CACHE_MAX_SIZE)
+    logging.debug("REPAIR BUILD CACHE: %d corrupt entries" % build_cache.repair())
+
+
 def execute_command(cmd, cwd=None):
     """
     Execute command with Popen
@@ -31,7 +31,8 @@ db_cursor = db.cursor()
 sql_file_list = [
     os.path.join(CUR_DIR, "sql", "modules.sql"),
     os.path.join(CUR_DIR, "sql", "boards.sql"),
-    os.path.join(CUR_DIR, "sql", "applications.sql")
+    os.path.join(CUR_DIR, "sql", "applications.sql"),
+    os.path.join(CUR_DIR, "sql", "supported_boards.sql")
 ]
 
 for sql_file_path in sql_file_list:
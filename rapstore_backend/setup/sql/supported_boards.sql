@@ -0,0 +1,7 @@
+SET SQL_MODE = "NO_AUTO_VALUE_ON_ZERO";
+SET time_zone = "+00:00";
+CREATE TABLE `supported_boards` (`application_id` int(10) UNSIGNED NOT NULL, `board_id` int(10) UNSIGNED NOT NULL, `riot_revision` varchar(40) COLLATE utf8_unicode_ci NOT NULL) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci;
+ALTER TABLE `supported_boards` ADD PRIMARY KEY (`application_id`, `board_id`);
+ALTER TABLE `supported_boards` ADD KEY `board_id` (`board_id`);
+CREATE TABLE `supported_boards_revisions` (`application_id` int(10) UNSIGNED NOT NULL, `riot_revision` varchar(40) COLLATE utf8_unicode_ci NOT NULL) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci;
+ALTER TABLE `supported_boards_revisions` ADD PRIMARY KEY (`application_id`);
@@ -11,9 +11,13 @@
 
 from __future__ import print_function
 
+import argparse
 import os
 import sys
-from shutil import copytree, rmtree, copyfile
+import time
+import uuid
+from shutil import copy2, copyfile, rmtree
+from stat import S_ISREG
 
 # append root of the python code tree to sys.apth so that imports are working
 #   alternative: add path to rapstore_backend to the PYTHONPATH environment variable, but this includes one more step
@@ -23,25 +27,45 @@ PROJECT_ROOT_DIR = os.path.normpath(os.path.join(CUR_DIR, os.pardir))
 sys.path.append(PROJECT_ROOT_DIR)
 
 from rapstore_backend.config import strip_config as config
+from rapstore_backend.config import config as backend_config
+from rapstore_backend.utility import build_utility as b_util
+from rapstore_backend.utility import archive_utility
 
+# every run creates a new version of the stripped repository in here, RIOT_stripped is a symbolic link to the active one
+VERSIONS_DIR_NAME = "RIOT_stripped_versions"
 
-def main():
+# copy2 of python 2 keeps modification times with microsecond precision only, so copies differ below that
+MTIME_TOLERANCE = 2e-6
+
+
+def main(argv):
+
+    args = init_argparse().parse_args(argv)
 
     path_riot = os.path.join(PROJECT_ROOT_DIR, "RIOT")
     path_riot_stripped = os.path.join(PROJECT_ROOT_DIR, "RIOT_stripped")
-    
+    path_versions = os.path.join(PROJECT_ROOT_DIR, VERSIONS_DIR_NAME)
+
+    version = "%d-%s" % (time.time(), uuid.uuid4().hex[:8])
+    path_version = os.path.join(path_versions, version)
+    path_version_temp = os.path.join(path_versions, ".tmp-%s" % version)
+
+    path_previous_version = None
+    if os.path.isdir(path_riot_stripped):
+        path_previous_version = os.path.realpath(path_riot_stripped)
+
     try:
-        if os.path.exists(path_riot_stripped):
-            rmtree(path_riot_stripped)
-            
-        copytree(path_riot, path_riot_stripped, ignore=config.ignore_patterns)
-        
-        path = os.path.join(path_riot_stripped, "Makefile.include")
+        b_util.create_directories(path_versions)
+
+        sync_tree(path_riot, path_version_temp, path_previous_version, config.ignore_patterns)
+
+        path = os.path.join(path_version_temp, "Makefile.include")
         # Save the old one to check later in case there is an error
         copyfile(path, path + '.old')
 
+        # write a new file instead of changing the existing one, it may be hard linked to the previous version
         with open(path + '.old', "r") as old_makefile:
-            with open(path, "w") as makefile:
+            with open(path + '.new', "w") as makefile:
                 for line in old_makefile.readlines():
 
                     if line.startswith("flash: all") or line.startswith("preflash: all"):
@@ -52,11 +76,192 @@ def main():
 
                     makefile.write(line)
 
+        os.rename(path + '.new', path)
+        os.rename(path_version_temp, path_version)
+
+        if args.boards:
+            create_board_trees(path_version)
+
+        path_previous_version = activate_version(path_riot_stripped, path_version)
+        remove_old_versions(path_versions, [path_version, path_previous_version])
+
     except Exception as e:
         print (e)
+
+        if os.path.exists(path_version_temp):
+            rmtree(path_version_temp)
+
         exit(1)
 
 
+def sync_tree(src_path, dest_path, previous_path, ignore):
+    """
+    Copy a directory tree. Files which did not change compared to a previous copy are hard linked to it instead of
+    being copied, so only changed files are written
+
+    Parameters
+    ----------
+    src_path: string
+        Directory to copy
+    dest_path: string
+        Path of the new copy, must not exist
+    previous_path: string
+        Previous copy of src_path, None if there is none
+    ignore: callable
+        Gets called with a directory and the names of its entries and returns the names to leave out, see
+        shutil.ignore_patterns
+
+    """
+    linked = 0
+    copied = 0
+
+    for dir_path, dir_names, file_names in os.walk(src_path, followlinks=True):
+
+        ignored_names = ignore(dir_path, dir_names + file_names)
+
+        # os.walk does only descend into directories which are left in dir_names
+        dir_names[:] = [name for name in dir_names if name not in ignored_names]
+
+        rel_dir_path = os.path.relpath(dir_path, src_path)
+        dest_dir_path = os.path.normpath(os.path.join(dest_path, rel_dir_path))
+        os.makedirs(dest_dir_path)
+
+        for name in file_names:
+            if name in ignored_names:
+                continue
+
+            src_file_path = os.path.join(dir_path, name)
+            dest_file_path = os.path.join(dest_dir_path, name)
+
+            if previous_path is not None:
+                previous_file_path = os.path.join(previous_path, rel_dir_path, name)
+
+                if _is_same_file_state(src_file_path, previous_file_path):
+                    try:
+                        os.link(previous_file_path, dest_file_path)
+                        linked += 1
+                        continue
+
+                    except OSError:
+                        pass
+
+            copy2(src_file_path, dest_file_path)
+            copied += 1
+
+    print("%d files copied, %d files linked to previous version" % (copied, linked))
+
+
+def _is_same_file_state(path, other_path):
+    """Check if both files have the same size and modification time. copy2 keeps the modification time."""
+    try:
+        stat = os.stat(path)
+        other_stat = os.lstat(other_path)
+
+    except OSError:
+        return False
+
+    return (S_ISREG(other_stat.st_mode) and stat.st_size == other_stat.st_size
+            and abs(stat.st_mtime - other_stat.st_mtime) < MTIME_TOLERANCE)
+
+
+def activate_version(path_riot_stripped, path_version):
+    """
+    Point the stripped repository to a version by atomically replacing its symbolic link
+
+    Parameters
+    ----------
+    path_riot_stripped: string
+        Path of the stripped RIOT repository, a symbolic link to the active version
+    path_version: string
+        Path of the version to activate
+
+    Returns
+    -------
+    string
+        Path of the previously active version, None if there was none
+
+    """
+    path_previous_version = None
+    if os.path.isdir(path_riot_stripped):
+        path_previous_version = os.path.realpath(path_riot_stripped)
+
+    temp_link_path = "%s.tmp-%s" % (path_riot_stripped, uuid.uuid4())
+    os.symlink(os.path.relpath(path_version, os.path.dirname(path_riot_stripped)), temp_link_path)
+
+    if os.path.isdir(path_riot_stripped) and not os.path.islink(path_riot_stripped):
+        # stripped repository of a previous setup is a plain directory, which can not be replaced atomically. It is
+        # kept as a version, so running builds do not lose their files
+        path_previous_version = os.path.join(os.path.dirname(path_version), "legacy-%d" % time.time())
+        os.rename(path_riot_stripped, path_previous_version)
+
+        # pre-stripped board trees of the previous setup are not part of any version, the ones of the kept version are
+        # created again on demand
+        rmtree(b_util.get_boards_stripped_riot_dir(path_riot_stripped), ignore_errors=True)
+
+    os.rename(temp_link_path, path_riot_stripped)
+
+    return path_previous_version
+
+
+def remove_old_versions(path_versions, keep_paths):
+    """
+    Remove all versions of the stripped repository and their pre-stripped board trees, except the given ones
+
+    Parameters
+    ----------
+    path_versions: string
+        Directory containing the versions
+    keep_paths: array_like with string
+        Paths of versions to keep, e.g. the previous one which may still be in use by running builds. May contain None
+
+    """
+    keep_paths = [os.path.realpath(path) for path in keep_paths if path is not None]
+
+    for name in os.listdir(path_versions):
+        path = os.path.join(path_versions, name)
+        version_path = path[:-len("_boards")] if path.endswith("_boards") else path
+
+        if name.startswith(".") or os.path.realpath(version_path) in keep_paths:
+            continue
+
+        print("Removing old version %s" % name)
+        rmtree(path, ignore_errors=True)
+
+
+def init_argparse():
+
+    parser = argparse.ArgumentParser(description='Create stripped version of the RIOT repository')
+
+    parser.add_argument('--boards',
+                        dest='boards', action='store_true', default=False,
+                        required=False,
+                        help='create a stripped tree and base archive for every board as well, '
+                             'otherwise they are created on demand')
+
+    return parser
+
+
+def create_board_trees(path_riot_stripped):
+    """
+    Create a stripped tree for every board, containing only the files of this board, and its base archive
+
+    Parameters
+    ----------
+    path_riot_stripped: string
+        Path to the stripped RIOT repository
+
+    """
+    boards_dir = os.path.join(path_riot_stripped, "boards")
+
+    for board in sorted(os.listdir(boards_dir)):
+
+        if b_util.is_board(boards_dir, board):
+            print("Creating stripped tree for %s" % board)
+            path_board_stripped = b_util.get_board_stripped_riot_dir(path_riot_stripped, board)
+            archive_utility.get_base_archive(path_board_stripped, backend_config.ARCHIVE_COMPRESSION,
+                                             backend_config.ARCHIVE_COMPRESSION_LEVEL)
+
+
 if __name__ == "__main__":
 
-    main()
+    main(sys.argv[1:])
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+ * Copyright (C) 2017 Hendrik van Essen
+ *
+ * This file is subject to the terms and conditions of the GNU Lesser
+ * General Public License v2.1. See the file LICENSE in the top level
+ * directory for more details.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+STATE_PENDING = "pending"
+STATE_RUNNING = "running"
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+
+# weight of the latest build time in the expected build time, smooths out builds slowed down by other builds
+DURATION_WEIGHT = 0.5
+
+
+class BuildJobQueue(object):
+    """
+    Persistent queue of build jobs, stored in an SQLite file. Every job is a (board, application) pair with a state
+    and a priority. Jobs with higher priority are taken first. Because the state of every job is stored, an
+    interrupted run can be resumed and only does the remaining jobs
+
+    Build times of successful jobs are kept across runs. Among jobs with the same priority, the one with the longest
+    expected build time is taken first (longest processing time first), so the run does not end with a few long
+    builds while the other workers are idle
+
+    Methods
+    -------
+    has_unfinished_jobs()
+        Check if jobs of a previous run are left
+    reset(jobs)
+        Replace all jobs
+    resume()
+        Make jobs of an interrupted run available again
+    pop()
+        Take the next job
+    complete(board, application, failed, max_attempts=1, duration=None)
+        Store the result of a job
+    get_counts()
+        Get number of jobs by state
+
+    """
+
+    _connection = None
+    _lock = None
+
+    def __init__(self, path):
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # shared by all worker threads, access is serialized with _lock
+        self._connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS jobs ("
+                                 "board TEXT NOT NULL, "
+                                 "application TEXT NOT NULL, "
+                                 "priority INTEGER NOT NULL, "
+                                 "state TEXT NOT NULL, "
+                                 "attempts INTEGER NOT NULL DEFAULT 0, "
+                                 "updated REAL NOT NULL, "
+                                 "PRIMARY KEY (board, application))")
+
+        columns = [row[1] for row in self._connection.execute("PRAGMA table_info(jobs)")]
+        if "expected_duration" not in columns:
+            # queue files written before build times were kept
+            self._connection.execute("ALTER TABLE jobs ADD COLUMN expected_duration REAL NOT NULL DEFAULT 0")
+
+        # in the order of pop, so the next job is found without sorting
+        self._connection.execute("DROP INDEX IF EXISTS jobs_next")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS jobs_order "
+                                 "ON jobs (state, priority DESC, expected_duration DESC)")
+
+        self._connection.execute("CREATE TABLE IF NOT EXISTS durations ("
+                                 "board TEXT NOT NULL, "
+                                 "application TEXT NOT NULL, "
+                                 "seconds REAL NOT NULL, "
+                                 "PRIMARY KEY (board, application))")
+        self._connection.commit()
+
+        self._lock = threading.Lock()
+
+    def has_unfinished_jobs(self):
+        """
+        Check if jobs of a previous run are left
+
+        Returns
+        -------
+        bool
+            True if there are pending or running jobs
+
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT COUNT(*) FROM jobs WHERE state IN (?, ?)",
+                                           (STATE_PENDING, STATE_RUNNING)).fetchone()
+
+        return row[0] > 0
+
+    def reset(self, jobs):
+        """
+        Replace all jobs
+
+        Parameters
+        ----------
+        jobs: array_like
+            List of (board, application, priority) tuples
+
+        """
+        now = time.time()
+
+        with self._lock:
+            get_expected_duration = self._get_expected_durations()
+
+            self._connection.execute("DELETE FROM jobs")
+            self._connection.executemany("INSERT OR REPLACE INTO jobs "
+                                         "(board, application, priority, state, updated, expected_duration) "
+                                         "VALUES (?, ?, ?, ?, ?, ?)",
+                                         [(board, application, priority, STATE_PENDING, now,
+                                           get_expected_duration(board, application))
+                                          for board, application, priority in jobs])
+            self._connection.commit()
+
+    def _get_expected_durations(self):
+        """
+        Get function estimating the build time of a job. Without a build time of the job itself, the average build
+        time of the application is used, then the one of the board, then the one of all jobs
+
+        """
+        durations = {}
+        for board, application, seconds in self._connection.execute("SELECT board, application, seconds "
+                                                                    "FROM durations"):
+            durations[(board, application)] = seconds
+
+        def average(values):
+            return sum(values) / len(values) if values else 0.0
+
+        by_application = {}
+        by_board = {}
+        for (board, application), seconds in durations.items():
+            by_application.setdefault(application, []).append(seconds)
+            by_board.setdefault(board, []).append(seconds)
+
+        application_averages = dict((application, average(values)) for application, values in by_application.items())
+        board_averages = dict((board, average(values)) for board, values in by_board.items())
+        total_average = average(list(durations.values()))
+
+        def get_expected_duration(board, application):
+
+            if (board, application) in durations:
+                return durations[(board, application)]
+
+            if application in application_averages:
+                return application_averages[application]
+
+            return board_averages.get(board, total_average)
+
+        return get_expected_duration
+
+    def resume(self):
+        """
+        Make jobs of an interrupted run available again. Jobs which were running are pending again
+
+        Returns
+        -------
+        int
+            Number of pending jobs
+
+        """
+        with self._lock:
+            self._connection.execute("UPDATE jobs SET state=?, updated=? WHERE state=?",
+                                     (STATE_PENDING, time.time(), STATE_RUNNING))
+            self._connection.commit()
+
+            row = self._connection.execute("SELECT COUNT(*) FROM jobs WHERE state=?", (STATE_PENDING,)).fetchone()
+
+        return row[0]
+
+    def pop(self):
+        """
+        Take the pending job with the highest priority and mark it as running
+
+        Returns
+        -------
+        tuple
+            (board, application), None if no job is pending
+
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT board, application FROM jobs WHERE state=? "
+                                           "ORDER BY priority DESC, expected_duration DESC, rowid LIMIT 1",
+                                           (STATE_PENDING,)).fetchone()
+
+            if row is None:
+                return None
+
+            self._connection.execute("UPDATE jobs SET state=?, attempts=attempts+1, updated=? "
+                                     "WHERE board=? AND application=?", (STATE_RUNNING, time.time()) + tuple(row))
+            self._connection.commit()
+
+        return tuple(row)
+
+    def complete(self, board, application, failed, max_attempts=1, duration=None):
+        """
+        Store the result of a job. A failed job is pending again until it was attempted max_attempts times. The build
+        time of a successful job is kept for following runs
+
+        Parameters
+        ----------
+        board: string
+            Board of the job
+        application: string
+            Application of the job
+        failed: bool
+            Whether the job failed
+        max_attempts: int (default =1)
+            Maximum number of attempts of a failing job
+        duration: float (default =None)
+            Build time in seconds
+
+        Returns
+        -------
+        string
+            New state of the job
+
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT attempts FROM jobs WHERE board=? AND application=?",
+                                           (board, application)).fetchone()
+
+            if not failed:
+                state = STATE_DONE
+
+            elif row is not None and row[0] < max_attempts:
+                state = STATE_PENDING
+
+            else:
+                state = STATE_FAILED
+
+            self._connection.execute("UPDATE jobs SET state=?, updated=? WHERE board=? AND application=?",
+                                     (state, time.time(), board, application))
+
+            if not failed and duration is not None:
+                self._update_duration(board, application, duration)
+
+            self._connection.commit()
+
+        return state
+
+    def _update_duration(self, board, application, duration):
+
+        row = self._connection.execute("SELECT seconds FROM durations WHERE board=? AND application=?",
+                                       (board, application)).fetchone()
+
+        if row is not None:
+            duration = DURATION_WEIGHT * duration + (1 - DURATION_WEIGHT) * row[0]
+
+        self._connection.execute("INSERT OR REPLACE INTO durations (board, application, seconds) VALUES (?, ?, ?)",
+                                 (board, application, duration))
+
+    def get_counts(self):
+        """
+        Get number of jobs by state
+
+        Returns
+        -------
+        dict
+            Number of jobs by state
+
+        """
+        counts = dict((state, 0) for state in (STATE_PENDING, STATE_RUNNING, STATE_DONE, STATE_FAILED))
+
+        with self._lock:
+            for state, count in self._connection.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state"):
+                counts[state] = count
+
+        return counts
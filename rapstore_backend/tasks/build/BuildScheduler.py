@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+ * Copyright (C) 2017 Hendrik van Essen
+ *
+ * This file is subject to the terms and conditions of the GNU Lesser
+ * General Public License v2.1. See the file LICENSE in the top level
+ * directory for more details.
+"""
+
+import logging
+import os
+import threading
+import time
+
+POLICY_FIXED = "fixed"
+POLICY_ADAPTIVE = "adaptive"
+
+POLICIES = (POLICY_FIXED, POLICY_ADAPTIVE)
+
+# load average and free memory lag behind started builds, so the limit is changed at most once per interval
+ADJUST_INTERVAL = 10
+
+
+def get_load_average():
+    """
+    Get load average of the last minute
+
+    Returns
+    -------
+    float
+        Load average, None if not available
+
+    """
+    try:
+        return os.getloadavg()[0]
+
+    except (AttributeError, OSError):
+        return None
+
+
+def get_available_memory():
+    """
+    Get memory available for new processes without swapping
+
+    Returns
+    -------
+    int
+        Available memory in bytes, None if not available
+
+    """
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+
+    except (IOError, ValueError):
+        pass
+
+    return None
+
+
+class BuildScheduler(object):
+    """
+    Decides how many builds run at the same time and how many jobs each make gets. Together the builds use about as
+    many jobs as there are CPUs: with fewer concurrent builds, each make runs with more jobs
+
+    With POLICY_FIXED, max_builds builds run all the time. With POLICY_ADAPTIVE, the scheduler starts with half of
+    them and adds one build at a time while load average and free memory allow it, or removes one if the machine is
+    overloaded
+
+    Methods
+    -------
+    acquire()
+        Wait until another build may start
+    release()
+        Mark a build as finished
+
+    """
+
+    _policy = None
+    _cpu_count = None
+    _max_builds = None
+    _max_make_jobs = None
+    _max_load = None
+    _min_free_memory = None
+
+    _limit = None
+    _running = 0
+    _last_adjust_time = 0
+    _condition = None
+
+    def __init__(self, policy, cpu_count, max_builds=None, max_make_jobs=None, max_load=None, min_free_memory=None):
+        """
+        Parameters
+        ----------
+        policy: string
+            One of POLICIES
+        cpu_count: int
+            Number of CPUs
+        max_builds: int (default =None)
+            Maximum number of concurrent builds, None for cpu_count
+        max_make_jobs: int (default =None)
+            Maximum number of jobs of one make, None for cpu_count
+        max_load: float (default =None)
+            Load average at which the adaptive policy removes a build, None for cpu_count
+        min_free_memory: int (default =None)
+            Available memory in bytes below which the adaptive policy removes a build, None to ignore memory
+
+        """
+        if policy not in POLICIES:
+            raise ValueError("unknown scheduling policy: %s" % policy)
+
+        self._policy = policy
+        self._cpu_count = cpu_count
+        self._max_builds = max_builds or cpu_count
+        self._max_make_jobs = max_make_jobs or cpu_count
+        self._max_load = max_load or float(cpu_count)
+        self._min_free_memory = min_free_memory
+
+        if policy == POLICY_ADAPTIVE:
+            self._limit = max(1, self._max_builds // 2)
+
+        else:
+            self._limit = self._max_builds
+
+        self._condition = threading.Condition()
+
+    @property
+    def max_builds(self):
+        return self._max_builds
+
+    def acquire(self):
+        """
+        Wait until another build may start
+
+        Returns
+        -------
+        int
+            Number of make jobs for the build
+
+        """
+        with self._condition:
+            while True:
+                self._adjust_limit()
+
+                if self._running < self._limit:
+                    break
+
+                # wake up regularly, the limit may be raised without a finished build
+                self._condition.wait(ADJUST_INTERVAL)
+
+            self._running += 1
+
+            return min(self._max_make_jobs, max(1, self._cpu_count // self._limit))
+
+    def release(self):
+        """
+        Mark a build as finished
+
+        """
+        with self._condition:
+            self._running -= 1
+            self._condition.notify()
+
+    def _adjust_limit(self):
+
+        if self._policy != POLICY_ADAPTIVE or time.time() - self._last_adjust_time < ADJUST_INTERVAL:
+            return
+
+        self._last_adjust_time = time.time()
+
+        load = get_load_average()
+        free_memory = get_available_memory()
+
+        overloaded = ((load is not None and load > self._max_load) or
+                      (free_memory is not None and self._min_free_memory is not None and
+                       free_memory < self._min_free_memory))
+
+        # keep some headroom, so the limit does not go up and down all the time
+        underloaded = ((load is None or load < 0.75 * self._max_load) and
+                       (free_memory is None or self._min_free_memory is None or
+                        free_memory > 2 * self._min_free_memory))
+
+        if overloaded and self._limit > 1:
+            self._limit -= 1
+            logging.debug("scheduler: load %s, free memory %s, builds down to %d" % (load, free_memory, self._limit))
+
+        elif underloaded and self._limit < self._max_builds and self._running >= self._limit:
+            self._limit += 1
+            logging.debug("scheduler: load %s, free memory %s, builds up to %d" % (load, free_memory, self._limit))
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+ * Copyright (C) 2017 Hendrik van Essen
+ *
+ * This file is subject to the terms and conditions of the GNU Lesser
+ * General Public License v2.1. See the file LICENSE in the top level
+ * directory for more details.
+"""
+
+# Check that builds are compiled through ccache and hit it. An application is built twice the same way build.py and
+# build_example.py do it, the second build has to take its objects from the cache.
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+from shutil import rmtree
+from subprocess import PIPE, Popen
+
+# append root of the python code tree to sys.apth so that imports are working
+#   alternative: add path to rapstore_backend to the PYTHONPATH environment variable, but this includes one more step
+#   which could be forget
+CUR_DIR = os.path.abspath(os.path.dirname(__file__))
+PROJECT_ROOT_DIR = os.path.normpath(os.path.join(CUR_DIR, os.pardir, os.pardir, os.pardir))
+sys.path.append(PROJECT_ROOT_DIR)
+
+from rapstore_backend.config import config
+from rapstore_backend.utility import build_utility as b_util
+
+HIT_STATISTICS = ("direct_cache_hit", "preprocessed_cache_hit")
+MISS_STATISTICS = ("cache_miss",)
+
+
+def main(argv):
+
+    args = init_argparse().parse_args(argv)
+
+    if config.CCACHE_DIR is None:
+        print("ccache is disabled, CCACHE_DIR is not set in config")
+        return 1
+
+    env = b_util.get_ccache_environment(os.path.join(PROJECT_ROOT_DIR, config.CCACHE_DIR), config.CCACHE_MAX_SIZE,
+                                        config.CCACHE_COMPILERS, PROJECT_ROOT_DIR)
+
+    if env is None:
+        print("ccache is not installed")
+        return 1
+
+    app_path = os.path.join(PROJECT_ROOT_DIR, config.path_root, args.application_dir)
+
+    statistics = [get_statistics(env)]
+
+    for _ in range(2):
+        output = build(app_path, args.board, env)
+        statistics.append(get_statistics(env))
+
+        if args.verbose:
+            print(output)
+
+    first_hits, first_misses = get_difference(statistics[0], statistics[1])
+    second_hits, second_misses = get_difference(statistics[1], statistics[2])
+
+    print("first build:  %d hits, %d misses" % (first_hits, first_misses))
+    print("second build: %d hits, %d misses" % (second_hits, second_misses))
+
+    if first_hits + first_misses == 0:
+        print("FAILED: no compiler call went through ccache, check CCACHE_COMPILERS in config")
+        return 1
+
+    if second_hits == 0 or second_misses > 0:
+        print("FAILED: the second build did not take all objects from the cache")
+        return 1
+
+    print("OK")
+    return 0
+
+
+def init_argparse():
+
+    parser = argparse.ArgumentParser(description='Check that builds hit ccache')
+
+    parser.add_argument('--application-dir',
+                        dest='application_dir', action='store',
+                        required=True,
+                        help='application relative to the RIOT repository, e.g. examples/hello-world')
+
+    parser.add_argument('--board',
+                        dest='board', action='store',
+                        required=True,
+                        help='the board the application is built for')
+
+    parser.add_argument('--verbose',
+                        dest='verbose', action='store_true', default=False,
+                        required=False,
+                        help='print the output of make')
+
+    return parser
+
+
+def build(app_path, board, env):
+    """
+    Build an application in a build directory like build_example.py
+
+    Parameters
+    ----------
+    app_path: string
+        Path to the application
+    board: string
+        Board name
+    env: dict
+        Environment of make, see build_utility.get_ccache_environment
+
+    Returns
+    -------
+    string
+        Output of make
+
+    """
+    app_build_parent_dir = os.path.join(PROJECT_ROOT_DIR, 'RIOT', 'generated_by_rapstore')
+    app_build_dir, app_build_dir_lock = b_util.lock_build_directory(app_build_parent_dir, b_util.APPLICATION_NAME)
+
+    try:
+        b_util.materialize_tree(app_path, app_build_dir, copied_paths=['Makefile'])
+        b_util.replace_application_name(os.path.join(app_build_dir, 'Makefile'), b_util.APPLICATION_NAME)
+
+        return b_util.execute_makefile(app_build_dir, board, b_util.APPLICATION_NAME, env=env)
+
+    finally:
+        if os.path.exists(app_build_dir):
+            rmtree(app_build_dir)
+
+        b_util.unlock_build_directory(app_build_dir_lock)
+
+
+def get_statistics(env):
+    """
+    Get statistics of ccache
+
+    Parameters
+    ----------
+    env: dict
+        Environment with CCACHE_DIR, see build_utility.get_ccache_environment
+
+    Returns
+    -------
+    dict
+        Counters by name
+
+    """
+    # machine readable statistics need ccache 3.7 or newer
+    process = Popen(["ccache", "--print-stats"], stdout=PIPE, env=env)
+    output = process.communicate()[0]
+
+    if process.returncode != 0:
+        raise RuntimeError("ccache --print-stats failed, ccache 3.7 or newer is needed")
+
+    statistics = {}
+
+    for line in output.decode("utf-8").splitlines():
+        fields = line.split("\t")
+
+        if len(fields) == 2 and fields[1].isdigit():
+            statistics[fields[0]] = int(fields[1])
+
+    return statistics
+
+
+def get_difference(before, after):
+    """
+    Get number of cache hits and misses between two statistics
+
+    Parameters
+    ----------
+    before: dict
+        Statistics before, see get_statistics
+    after: dict
+        Statistics after
+
+    Returns
+    -------
+    tuple
+        Number of hits and number of misses
+
+    """
+    def difference(names):
+        return sum(after.get(name, 0) - before.get(name, 0) for name in names)
+
+    return difference(HIT_STATISTICS), difference(MISS_STATISTICS)
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
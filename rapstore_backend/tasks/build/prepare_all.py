@@ -11,13 +11,12 @@
 
 from __future__ import print_function
 
-import ast
+import argparse
 import logging
 import multiprocessing
 import os
 import sys
 from multiprocessing.pool import ThreadPool
-from subprocess import PIPE, STDOUT, Popen
 from datetime import datetime
 
 # append root of the python code tree to sys.apth so that imports are working
@@ -26,63 +25,141 @@ from datetime import datetime
 CUR_DIR = os.path.abspath(os.path.dirname(__file__))
 PROJECT_ROOT_DIR = os.path.normpath(os.path.join(CUR_DIR, os.pardir, os.pardir, os.pardir))
 sys.path.append(PROJECT_ROOT_DIR)
+# build_example.py imports its modules relative to rapstore_backend
+sys.path.append(os.path.join(PROJECT_ROOT_DIR, "rapstore_backend"))
 
 from rapstore_backend.config import config
+from BuildJobQueue import BuildJobQueue, STATE_FAILED, STATE_PENDING
+from BuildScheduler import BuildScheduler, POLICIES
 from BuildTaskStatistic import BuildTaskStatistic
+from rapstore_backend.common.ApplicationCache import ApplicationCache
+from rapstore_backend.common.BuildResult import get_build_result_template
 from rapstore_backend.common.MyDatabase import MyDatabase
+from rapstore_backend.utility import archive_utility
+from rapstore_backend.utility import build_utility as b_util
+import build_example
 
 LOGFILE = os.path.join(PROJECT_ROOT_DIR, "log", "prepare_all.log")
+BUILD_JOB_QUEUE_FILE = os.path.join(PROJECT_ROOT_DIR, config.BUILD_JOB_QUEUE_FILE)
+APPLICATION_CACHE_DIR = os.path.join(PROJECT_ROOT_DIR, config.APPLICATION_CACHE_DIR)
 USING_CACHE = True
 
 db = MyDatabase()
 stat = BuildTaskStatistic()
 
-task_list_lock = multiprocessing.Lock()
 
+def main(argv):
 
-def main():
+    args = init_argparse().parse_args(argv)
 
-    pool_size = multiprocessing.cpu_count()
+    policy = args.policy or config.PREPARE_ALL_SCHEDULING_POLICY
 
-    print("preparing build tasks...")
-    task_list = get_tasks()
+    scheduler = BuildScheduler(policy,
+                               multiprocessing.cpu_count(),
+                               config.PREPARE_ALL_MAX_BUILDS,
+                               config.PREPARE_ALL_MAX_MAKE_JOBS,
+                               config.PREPARE_ALL_MAX_LOAD,
+                               config.PREPARE_ALL_MIN_FREE_MEMORY)
 
-    print("got %s tasks" % len(task_list))
+    # started before anything is opened, so the forked processes do not share database connections or files
+    build_pool = multiprocessing.Pool(scheduler.max_builds)
+
+    job_queue = BuildJobQueue(BUILD_JOB_QUEUE_FILE)
+
+    if job_queue.has_unfinished_jobs() and not args.restart:
+        print("resuming interrupted run: %d tasks left" % job_queue.resume())
+
+    else:
+        print("preparing build tasks...")
+        task_list = get_tasks()
+
+        print("got %s tasks" % len(task_list))
+
+        if USING_CACHE:
+            task_list = get_uncached_tasks(task_list, args.archives)
+            print("%d tasks not cached yet" % len(task_list))
+
+        job_queue.reset(get_prioritized_tasks(task_list))
 
     stat.start()
 
     print("using cache: %s" % str(USING_CACHE))
+    print("prefetching archives: %s" % str(args.archives))
 
-    print("starting %d workers..." % pool_size)
-    pool = ThreadPool(pool_size, build_worker, (task_list,))
+    print("scheduling policy: %s" % policy)
+
+    print("starting %d workers..." % scheduler.max_builds)
+    pool = ThreadPool(scheduler.max_builds, build_worker,
+                      (job_queue, scheduler, build_pool, args.archives, 1 + args.retries))
     pool.close()
     pool.join()
 
+    build_pool.close()
+    build_pool.join()
+
     stat.stop()
     print(stat)
 
+    counts = job_queue.get_counts()
+    print("tasks done: %d, failed: %d" % (counts["done"], counts["failed"]))
+
+
+def init_argparse():
+
+    parser = argparse.ArgumentParser(description='Build all applications for all supported boards')
+
+    parser.add_argument('--archives',
+                        dest='archives', action='store_true', default=False,
+                        required=False,
+                        help='generate and cache the archives returned to the user as well')
+
+    parser.add_argument('--restart',
+                        dest='restart', action='store_true', default=False,
+                        required=False,
+                        help='start over instead of resuming an interrupted run')
+
+    parser.add_argument('--retries',
+                        dest='retries', type=int, default=1,
+                        required=False,
+                        help='number of times a failed build is retried')
+
+    parser.add_argument('--policy',
+                        dest='policy', action='store',
+                        choices=POLICIES,
+                        required=False,
+                        help='how the number of concurrent builds is chosen, default is set in config')
+
+    return parser
 
-def build_worker(task_list):
+
+def build_worker(job_queue, scheduler, build_pool, prefetch_archive, max_attempts):
     """
-    Execute a given build task
+    Execute build tasks until the queue is empty. The builds run in the processes of build_pool, this thread only
+    waits for them
 
     Parameters
     ----------
-    (board, application): tuple
-        Tuple containing a board and an application
+    job_queue: BuildJobQueue
+        Queue of (board, application) tasks, shared between all workers
+    scheduler: BuildScheduler
+        Decides when a build starts and how many make jobs it gets, shared between all workers
+    build_pool: multiprocessing.Pool
+        Processes executing build_in_process, shared between all workers
+    prefetch_archive: bool
+        Whether archives should be generated and cached as well
+    max_attempts: int
+        Maximum number of attempts of a failing task
 
     """
     while True:
 
-        task = None
+        make_jobs = scheduler.acquire()
 
-        task_list_lock.acquire()
-        if len(task_list) > 0:
-            task = task_list.pop(0)
-        task_list_lock.release()
+        task = job_queue.pop()
 
         if task is None:
             # no more tasks left in queue, finish this worker
+            scheduler.release()
             return
 
         board = task[0]
@@ -90,25 +167,24 @@ def build_worker(task_list):
 
         start_time = datetime.now().replace(microsecond=0)
 
-        cmd = ["python", "build_example.py",
-               "--application", application,
-               "--board", board,
-               "--prefetching"]
-
-        if USING_CACHE:
-            cmd.append("--caching")
+        try:
+            build_result = build_pool.apply(build_in_process, (board, application, prefetch_archive, make_jobs))
 
-        process = Popen(cmd, stdout=PIPE, stderr=STDOUT, cwd=os.path.join(PROJECT_ROOT_DIR, "rapstore_backend"))
-        output = process.communicate()[0]
+        finally:
+            scheduler.release()
 
         end_time = datetime.now().replace(microsecond=0)
         delta = end_time - start_time
 
-        build_result = ast.literal_eval(output)
-
         failed = not build_result["success"]
 
-        stat.add_completed_task(delta, failed)
+        state = job_queue.complete(board, application, failed, max_attempts, delta.total_seconds())
+
+        if state == STATE_PENDING:
+            print("[RETRY]:  Build of {0} for {1}".format(application, board))
+            continue
+
+        stat.add_completed_task(delta, state == STATE_FAILED)
 
         if failed:
             print("[FAILED]: Build of {0} for {1}".format(application, board))
@@ -118,60 +194,136 @@ def build_worker(task_list):
             print("[DONE]:   Build of {0} for {1}".format(application, board))
 
 
+def build_in_process(board, application, prefetch_archive, make_jobs):
+    """
+    Build an application in a process of the build pool. Modules, database connection and metadata cache of
+    build_example.py stay loaded between builds
+
+    Parameters
+    ----------
+    board: string
+        Board name
+    application: string
+        ID of the application
+    prefetch_archive: bool
+        Whether the archive should be generated and cached as well
+    make_jobs: int
+        Number of jobs make runs in parallel
+
+    Returns
+    -------
+    dict
+        Build result
+
+    """
+    try:
+        return build_example.build(build_example.db, application, board, USING_CACHE, True, prefetch_archive,
+                                   make_jobs=make_jobs)
+
+    except Exception as e:
+        logging.error(str(e), exc_info=True)
+
+        build_result = get_build_result_template()
+        build_result["cmd_output"] += str(e)
+        return build_result
+
+    finally:
+        # end the transaction, so changed tables are seen by the next build
+        build_example.db.close()
+
+
 def get_tasks():
     """
-    Generate build tasks
+    Generate build tasks from table "supported_boards", which is filled by db_update.py
 
     Returns
     -------
     array_like
-        List of (board, applications) tuples
+        List of (board, application) tuples, application is a dict with keys "id", "name" and "path"
 
     """
-    applications = fetch_applications()
+    db.query("SELECT applications.id, applications.name, applications.path, boards.internal_name "
+             "FROM supported_boards "
+             "JOIN applications ON applications.id = supported_boards.application_id "
+             "JOIN boards ON boards.id = supported_boards.board_id "
+             "ORDER BY applications.name, boards.internal_name")
 
     task_list = []
-    for application in applications:
-
-        app_dir = application["path"]
+    for row in db.fetchall():
 
-        for board in get_supported_boards(app_dir):
-            task_list.append((board, str(application["id"])))
+        application = {"id": row["id"], "name": row["name"], "path": row["path"]}
+        task_list.append((row["internal_name"], application))
 
     return task_list
 
 
-def get_supported_boards(app_dir):
+def get_uncached_tasks(task_list, prefetch_archive):
     """
-    Get all supported boards for an application
+    Drop build tasks whose results are in the application cache already. Entries of changed boards and applications
+    are removed from the cache by push_webhook_handler.py, so cached results are up to date
 
     Parameters
     ----------
-    app_dir: string
-        Path to the application directory
+    task_list: array_like
+        List of (board, application) tuples
+    prefetch_archive: bool
+        Whether archives should be generated and cached as well
 
     Returns
     -------
     array_like
-        List of board names of supported boards
+        List of (board, application) tuples which have to be built
 
     """
-    # command to get supported devices from .murdock script in RIOT repository within get_supported_boards()
-    # 2>/dev/null replaced by stderr=open(os.devnull, 'w')
-    dev_null = open(os.devnull, "w")
-    process = Popen(["make", "--no-print-directory", "-C", app_dir, "info-boards-supported"], stdout=PIPE, stderr=dev_null)
-    output = process.communicate()[0]
+    application_cache = ApplicationCache(APPLICATION_CACHE_DIR, config.APPLICATION_CACHE_MAX_SIZE)
 
-    return output.split()
+    compression = config.ARCHIVE_COMPRESSION
+    compression_level = archive_utility.get_compression_level(compression, config.ARCHIVE_COMPRESSION_LEVEL)
+    archive_file_name = b_util.archive_file_name(compression_level, archive_utility.get_archive_extension(compression))
 
+    uncached_tasks = []
+    for board, application in task_list:
 
-def fetch_boards():
-    db.query("SELECT * FROM boards ORDER BY display_name")
-    return db.fetchall()
+        app_dir_name = os.path.basename(application["path"])
+
+        if prefetch_archive:
+            # build_example.py returns a cached archive without looking at the binaries
+            file_names = [archive_file_name]
+
+        else:
+            file_names = ["%s.elf" % application["name"], "%s.hex" % application["name"]]
+
+        if not all(application_cache.contains(board, app_dir_name, file_name) for file_name in file_names):
+            uncached_tasks.append((board, application))
+
+    return uncached_tasks
 
 
-def fetch_applications():
-    db.query("SELECT * FROM applications ORDER BY name")
+def get_prioritized_tasks(task_list):
+    """
+    Add priorities to build tasks. Tasks of boards listed in config.PREPARE_ALL_PRIORITY_BOARDS come first, in the
+    order of the list
+
+    Parameters
+    ----------
+    task_list: array_like
+        List of (board, application) tuples
+
+    Returns
+    -------
+    array_like
+        List of (board, application ID, priority) tuples
+
+    """
+    priority_boards = config.PREPARE_ALL_PRIORITY_BOARDS
+
+    priorities = dict((board, len(priority_boards) - index) for index, board in enumerate(priority_boards))
+
+    return [(board, str(application["id"]), priorities.get(board, 0)) for board, application in task_list]
+
+
+def fetch_boards():
+    db.query("SELECT * FROM boards ORDER BY display_name")
     return db.fetchall()
 
 
@@ -181,7 +333,7 @@ if __name__ == "__main__":
                         datefmt="%Y-%m-%d %H:%M:%S", level=logging.DEBUG)
 
     try:
-        main()
+        main(sys.argv[1:])
 
     except Exception as e:
         logging.error(str(e), exc_info=True)
@@ -9,8 +9,12 @@
  * directory for more details.
 """
 
+from __future__ import print_function
+
+import multiprocessing
 import os
 import sys
+from multiprocessing.pool import ThreadPool
 
 # append root of the python code tree to sys.apth so that imports are working
 #   alternative: add path to rapstore_backend to the PYTHONPATH environment variable, but this includes one more step
@@ -21,54 +25,236 @@ sys.path.append(PROJECT_ROOT_DIR)
 
 from rapstore_backend.config import config
 from rapstore_backend.common.MyDatabase import MyDatabase
+from rapstore_backend.common.common import update_database_version
+from rapstore_backend.common.SourceIndex import SourceIndex
+from rapstore_backend.utility import build_utility as b_util
 import replace_board_display_names as rbdn
 
 db = MyDatabase()
 
+# scanning mostly waits for file reads, so more threads than cores are used
+SCAN_POOL_SIZE = 4 * multiprocessing.cpu_count()
+SCAN_CHUNK_SIZE = 16
+
+# every make evaluates the whole build system, so one per core
+BOARD_SUPPORT_POOL_SIZE = multiprocessing.cpu_count()
+
+RIOT_DIR = os.path.join(PROJECT_ROOT_DIR, config.path_root)
+
 
 def main():
 
-    update_modules()
-    update_boards()
-    update_applications()
+    source_index = SourceIndex(os.path.join(PROJECT_ROOT_DIR, config.SOURCE_INDEX_FILE))
+    indexed_entries = source_index.load()
+
+    pool = ThreadPool(SCAN_POOL_SIZE)
+
+    # directories are scanned in the background, while the database is updated
+    modules = scan_directories_async(pool, config.module_directories, indexed_entries)
+    applications = scan_directories_async(pool, config.application_directories, indexed_entries)
+
+    pool.close()
+
+    module_results = modules.get()
+    application_results = applications.get()
+
+    riot_revision = b_util.get_riot_revision(RIOT_DIR)
+    application_paths = [row['path'] for row, _ in application_results]
 
-    # now update the overwritten board display names
-    rbdn.main()
+    # make takes minutes for all applications, so it runs outside of any transaction. The boards are determined for
+    # riot_revision, so writing them is still correct if another run stored the same applications in the meantime
+    with db:
+        outdated_paths = get_outdated_applications(application_paths, riot_revision)
 
+    supported_boards = get_supported_boards(outdated_paths)
 
-def update_modules():
+    # all tables are changed in one transaction, clients never see half updated or empty tables
+    with db:
+        update_modules([row for row, _ in module_results])
+        update_boards()
+        update_applications([row for row, _ in application_results])
+        update_supported_boards(supported_boards, riot_revision)
+
+    pool.join()
+
+    # let running processes drop their cached database content
+    update_database_version(os.path.join(PROJECT_ROOT_DIR, config.DATABASE_VERSION_FILE))
+
+    source_index.store(dict((row['path'], index_entry) for row, index_entry in module_results + application_results))
+
+
+def scan_directories_async(pool, directories, indexed_entries):
     """
-    Update table "modules". The table is truncated and data is re-imported
+    Start extracting name and description of every entry in the given directories
+
+    Parameters
+    ----------
+    pool: ThreadPool
+        Pool the entries are scanned in
+    directories: array_like with string
+        Directories relative to path_root of config, e.g. "sys"
+    indexed_entries: dict
+        Entries of the source index by path, see SourceIndex.load
+
+    Returns
+    -------
+    AsyncResult
+        Result is a list with the result of scan_entry for every entry
 
     """
-    
-    db.query('TRUNCATE modules')
-    
-    for i in range(len(config.module_directories)):
+    entries = []
 
-        module_directory = config.module_directories[i]
-        module_path = os.path.join(PROJECT_ROOT_DIR, config.path_root, module_directory)
+    for directory in directories:
+        path = os.path.join(PROJECT_ROOT_DIR, config.path_root, directory)
 
-        for name in os.listdir(module_path):
-            if not os.path.isfile(os.path.join(module_path, name)):
+        for name in os.listdir(path):
+            if not os.path.isfile(os.path.join(path, name)):
 
                 # ignoring include directories
                 if name == 'include':
                     continue
-                    
-                description = get_description(module_path, name)
-                    
-                module_name = get_name(os.path.join(module_path, name), name)
-                
-                sql = 'INSERT INTO modules (name, path, description, group_identifier) VALUES (%s, %s, %s, %s);'
-                db.query(sql, (module_name, os.path.join(module_path, name), description, module_directory))
 
-    db.commit()
+                entries.append((path, name, directory, indexed_entries.get(os.path.join(path, name))))
+
+    return pool.map_async(scan_entry, entries, SCAN_CHUNK_SIZE)
+
+
+def scan_entry(entry):
+    """
+    Extract name and description of a module or application. Files are only parsed if they changed since the entry
+    was indexed
+
+    Parameters
+    ----------
+    entry: tuple
+        Parent directory, directory name, group identifier and source index entry (None if not indexed) of the entry
+
+    Returns
+    -------
+    tuple
+        Row with keys "name", "path", "description" and "group_identifier" and the updated source index entry
+
+    """
+    path, name, group_identifier, indexed_entry = entry
+
+    value, index_entry = SourceIndex.lookup(indexed_entry, get_source_files(path, name))
+
+    if value is None:
+        value = {
+            'name': get_name(os.path.join(path, name), name),
+            'description': get_description(path, name)
+        }
+
+    index_entry['value'] = value
+
+    row = {
+        'name': value['name'],
+        'path': os.path.join(path, name),
+        'description': value['description'],
+        'group_identifier': group_identifier
+    }
+
+    return row, index_entry
+
+
+def get_source_files(path, name):
+    """
+    Get all files name and description of an entry are extracted from, see get_name and get_description
+
+    Parameters
+    ----------
+    path: string
+        Path in which the entry is
+    name: string
+        Name of the entry directory
+
+    Returns
+    -------
+    array_like
+        Paths to the files, not all of them have to exist
+
+    """
+    return [
+        os.path.join(path, name, 'Makefile'),
+        os.path.join(path, 'include', name + '.h'),
+        os.path.join(path, name, 'doc.txt'),
+        os.path.join(path, name, name + '.c'),
+        os.path.join(path, name, 'main.c')
+    ]
+
+
+def get_outdated_applications(application_paths, riot_revision):
+    """
+    Get applications whose supported boards were not determined for the given RIOT revision
+
+    Parameters
+    ----------
+    application_paths: array_like with string
+        Paths to the application directories
+    riot_revision: string
+        Commit hash of the RIOT repository, None if unknown
+
+    Returns
+    -------
+    list
+        Paths of the outdated applications, all of them if the revision is unknown
+
+    """
+    up_to_date_paths = set()
+
+    if riot_revision is not None:
+        db.query('SELECT applications.path FROM supported_boards_revisions '
+                 'JOIN applications ON applications.id = supported_boards_revisions.application_id '
+                 'WHERE supported_boards_revisions.riot_revision = %s', (riot_revision,))
+        up_to_date_paths = set(row['path'] for row in db.fetchall())
+
+    paths = [path for path in application_paths if path not in up_to_date_paths]
+
+    print('supported boards: %d applications up to date, %d outdated' % (len(application_paths) - len(paths),
+                                                                        len(paths)))
+
+    return paths
+
+
+def get_supported_boards(application_paths):
+    """
+    Get the supported boards of applications, in parallel
+
+    Parameters
+    ----------
+    application_paths: array_like with string
+        Paths to the application directories
+
+    Returns
+    -------
+    dict
+        Board names by application path
+
+    """
+    pool = ThreadPool(BOARD_SUPPORT_POOL_SIZE)
+    boards = pool.map(b_util.get_supported_boards, application_paths)
+    pool.close()
+    pool.join()
+
+    return dict(zip(application_paths, boards))
+
+
+def update_modules(modules):
+    """
+    Update table "modules". Rows are matched by path, so IDs of existing modules do not change
+
+    Parameters
+    ----------
+    modules: array_like with dict
+        Scanned modules, see scan_entry
+
+    """
+    sync_table('modules', 'path', ['name', 'path', 'description', 'group_identifier'], modules)
 
 
 def update_boards():
     """
-    Update table "boards". The table is truncated and data is re-imported
+    Update table "boards". Rows are matched by internal name, so IDs of existing boards do not change
 
     """
 
@@ -86,47 +272,144 @@ def update_boards():
                 and not item == 'native'
         )
 
-    db.query('TRUNCATE boards')
-    
     path = os.path.join(PROJECT_ROOT_DIR, config.path_root, 'boards')
 
+    boards = []
+
     for item in os.listdir(path):
         if is_valid_board(path, item):
-            
-            sql = 'INSERT INTO boards (display_name, internal_name, flash_program) VALUES (%s, %s, %s);'
-            db.query(sql, (item, item, 'openocd'))
-            
-    db.commit()
 
+            boards.append({
+                'display_name': rbdn.get_display_name(item),
+                'internal_name': item,
+                'flash_program': 'openocd'
+            })
+
+    sync_table('boards', 'internal_name', ['display_name', 'internal_name', 'flash_program'], boards)
 
-def update_applications():
+
+def update_applications(applications):
     """
-    Update table "applications". The table is truncated and data is re-imported
+    Update table "applications". Rows are matched by path, so IDs of existing applications do not change
+
+    Parameters
+    ----------
+    applications: array_like with dict
+        Scanned applications, see scan_entry
 
     """
+    sync_table('applications', 'path', ['name', 'path', 'description', 'group_identifier'], applications)
 
-    db.query('TRUNCATE applications')
-    
-    for i in range(len(config.application_directories)):
 
-        application_directory = config.application_directories[i]
-        application_path = os.path.join(PROJECT_ROOT_DIR, config.path_root, application_directory)
+def update_supported_boards(supported_boards, riot_revision):
+    """
+    Update tables "supported_boards" and "supported_boards_revisions" for the given applications and remove rows of
+    applications and boards which do not exist anymore. Has to run after the tables "applications" and "boards" are
+    updated
 
-        for name in os.listdir(application_path):
-            if not os.path.isfile(os.path.join(application_path, name)):
+    Parameters
+    ----------
+    supported_boards: dict
+        Board names by application path, see get_supported_boards
+    riot_revision: string
+        Commit hash of the RIOT repository the boards were determined with, None if unknown
 
-                # ignoring include directories
-                if name == 'include':
-                    continue
-                    
-                description = get_description(application_path, name)
-                    
-                application_name = get_name(os.path.join(application_path, name), name)
-                
-                sql = 'INSERT INTO applications (name, path, description, group_identifier) VALUES (%s, %s, %s, %s);'
-                db.query(sql, (application_name, os.path.join(application_path, name), description, application_directory))
+    """
+    db.query('SELECT id, path FROM applications')
+    application_ids = dict((row['path'], row['id']) for row in db.fetchall())
+
+    db.query('SELECT id, internal_name FROM boards')
+    board_ids = dict((row['internal_name'], row['id']) for row in db.fetchall())
+
+    db.query('DELETE FROM supported_boards WHERE application_id NOT IN (SELECT id FROM applications) '
+             'OR board_id NOT IN (SELECT id FROM boards)')
+    db.query('DELETE FROM supported_boards_revisions WHERE application_id NOT IN (SELECT id FROM applications)')
+
+    deletes = []
+    inserts = []
+    revisions = []
+
+    for path, boards in supported_boards.items():
+        application_id = application_ids[path]
+        deletes.append((application_id,))
+
+        # also stored for applications without any supported board, so they are not determined again
+        revisions.append((application_id, riot_revision or ''))
+
+        # boards which are not in table "boards", e.g. native, can not be chosen anyway
+        inserts.extend((application_id, board_ids[board], riot_revision or '') for board in boards if board in board_ids)
+
+    if deletes:
+        db.executemany('DELETE FROM supported_boards WHERE application_id=%s', deletes)
+        db.executemany('REPLACE INTO supported_boards_revisions (application_id, riot_revision) VALUES (%s, %s)',
+                       revisions)
+
+    if inserts:
+        db.executemany('INSERT INTO supported_boards (application_id, board_id, riot_revision) VALUES (%s, %s, %s)',
+                       inserts)
+
+    print('supported_boards: %d applications updated' % len(deletes))
+
+
+def sync_table(table, key_column, columns, rows):
+    """
+    Bring a table in line with the given rows. Only inserts, updates and deletes of changed rows are executed, each
+    kind as one batch. Nothing is committed
+
+    Parameters
+    ----------
+    table: string
+        Name of the table
+    key_column: string
+        Column identifying a row, e.g. "path"
+    columns: array_like with string
+        Columns to write, including key_column
+    rows: array_like with dict
+        Wanted content of the table, values by column name
+
+    """
+    db.query('SELECT id, %s FROM %s' % (', '.join(columns), table))
+
+    existing_rows = {}
+    deletes = []
+
+    for existing_row in db.fetchall():
+        key = existing_row[key_column]
+
+        if key in existing_rows:
+            # duplicate, e.g. left over from an interrupted update
+            deletes.append((existing_row['id'],))
+
+        else:
+            existing_rows[key] = existing_row
+
+    inserts = []
+    updates = []
+
+    for row in rows:
+        values = tuple(row[column] for column in columns)
+        existing_row = existing_rows.pop(row[key_column], None)
+
+        if existing_row is None:
+            inserts.append(values)
+
+        elif values != tuple(existing_row[column] for column in columns):
+            updates.append(values + (existing_row['id'],))
+
+    deletes.extend((existing_row['id'],) for existing_row in existing_rows.values())
+
+    if inserts:
+        placeholders = ', '.join(['%s'] * len(columns))
+        db.executemany('INSERT INTO %s (%s) VALUES (%s)' % (table, ', '.join(columns), placeholders), inserts)
+
+    if updates:
+        assignments = ', '.join('%s=%%s' % column for column in columns)
+        db.executemany('UPDATE %s SET %s WHERE id=%%s' % (table, assignments), updates)
+
+    if deletes:
+        db.executemany('DELETE FROM %s WHERE id=%%s' % table, deletes)
 
-    db.commit()
+    print('%s: %d inserted, %d updated, %d deleted' % (table, len(inserts), len(updates), len(deletes)))
 
 
 def get_description(path, name):
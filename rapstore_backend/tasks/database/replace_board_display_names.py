@@ -137,12 +137,31 @@ def main():
 
     sql = 'UPDATE boards SET display_name=%s WHERE internal_name=%s;'
 
-    for internal_name, display_name in replacement_dict.iteritems():
+    db.executemany(sql, [(get_display_name(internal_name), internal_name) for internal_name in replacement_dict])
+    db.commit()
 
-        constructed_display_name = display_name + ' (%s)' % internal_name
-        db.query(sql, (constructed_display_name, internal_name))
 
-    db.commit()
+def get_display_name(internal_name):
+    """
+    Get display name of a board
+
+    Parameters
+    ----------
+    internal_name: string
+        Internal name of the board
+
+    Returns
+    -------
+    string
+        Display name, the internal name if no replacement is known
+
+    """
+    display_name = replacement_dict.get(internal_name)
+
+    if display_name is None:
+        return internal_name
+
+    return display_name + ' (%s)' % internal_name
 
 
 if __name__ == '__main__':
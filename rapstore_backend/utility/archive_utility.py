@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+"""
+ * Copyright (C) 2017 Hendrik van Essen
+ *
+ * This file is subject to the terms and conditions of the GNU Lesser
+ * General Public License v2.1. See the file LICENSE in the top level
+ * directory for more details.
+"""
+
+# Archives returned to the user consist of two layers: the stripped RIOT repository of a board, which is the same for
+# every build, and the application layer. The base layer is written once as a compressed tar stream without the
+# end-of-archive marker. An archive is then created by copying the base layer and appending the application layer as
+# another compressed member. gzip, xz and zstd all read concatenated members as one stream, so tar sees one continuous
+# archive.
+
+import gzip
+import os
+import tarfile
+import time
+import uuid
+from shutil import copyfileobj
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION_NONE = "none"
+COMPRESSION_GZIP = "gz"
+COMPRESSION_XZ = "xz"
+COMPRESSION_ZSTD = "zst"
+
+COMPRESSIONS = (COMPRESSION_NONE, COMPRESSION_GZIP, COMPRESSION_XZ, COMPRESSION_ZSTD)
+
+DEFAULT_COMPRESSION_LEVELS = {
+    COMPRESSION_NONE: 0,
+    COMPRESSION_GZIP: 9,
+    COMPRESSION_XZ: 6,
+    COMPRESSION_ZSTD: 3
+}
+
+# lowest and highest level accepted by each compression
+COMPRESSION_LEVEL_RANGES = {
+    COMPRESSION_NONE: (0, 0),
+    COMPRESSION_GZIP: (0, 9),
+    COMPRESSION_XZ: (0, 9),
+    COMPRESSION_ZSTD: (1, 22)
+}
+
+
+def get_available_compressions():
+    """
+    Get compressions usable with the installed python modules
+
+    Returns
+    -------
+    array_like
+        List of compression names
+
+    """
+    unavailable = []
+
+    if lzma is None:
+        unavailable.append(COMPRESSION_XZ)
+
+    if zstandard is None:
+        unavailable.append(COMPRESSION_ZSTD)
+
+    return [compression for compression in COMPRESSIONS if compression not in unavailable]
+
+
+def get_compression_level(compression, level=None):
+    """
+    Check compression and get the level to use with it
+
+    Parameters
+    ----------
+    compression: string
+        Name of the compression, one of COMPRESSIONS
+    level: int (default =None)
+        Requested level, None for the default level of the compression
+
+    Returns
+    -------
+    int
+        Compression level
+
+    Raises
+    -------
+    ValueError
+        Compression is unknown or not available, or level is out of the range of the compression
+
+    """
+    if compression not in get_available_compressions():
+        raise ValueError("compression not available: %s" % compression)
+
+    if level is None:
+        return DEFAULT_COMPRESSION_LEVELS[compression]
+
+    level = int(level)
+    min_level, max_level = COMPRESSION_LEVEL_RANGES[compression]
+
+    if not min_level <= level <= max_level:
+        raise ValueError("compression level of %s has to be between %d and %d: %d" % (compression, min_level,
+                                                                                       max_level, level))
+
+    return level
+
+
+def get_archive_extension(compression):
+    """
+    Get file extension of an archive with given compression
+
+    Parameters
+    ----------
+    compression: string
+        Name of the compression
+
+    Returns
+    -------
+    string
+        File extension, e.g. "tar.gz"
+
+    """
+    if compression == COMPRESSION_NONE:
+        return "tar"
+
+    return "tar.%s" % compression
+
+
+def get_base_archive(board_riot_path, compression=COMPRESSION_GZIP, level=None):
+    """
+    Return path to the base archive of a pre-stripped RIOT tree. It is created if not existing yet
+
+    Parameters
+    ----------
+    board_riot_path: string
+        Path to the pre-stripped RIOT tree of a board, see build_utility.get_board_stripped_riot_dir
+    compression: string (default =COMPRESSION_GZIP)
+        Name of the compression
+    level: int (default =None)
+        Compression level, None for the default level of the compression
+
+    Returns
+    -------
+    string
+        Path to the base archive
+
+    Raises
+    -------
+    IOError
+        Pre-stripped tree does not exist
+
+    """
+    # the base archive is stored next to the tree, so a missing tree must not leave an archive behind
+    if not os.path.isdir(board_riot_path):
+        raise IOError("no pre-stripped tree: %s" % board_riot_path)
+
+    level = get_compression_level(compression, level)
+
+    base_archive_path = "%s.base-%d.%s" % (board_riot_path, level, get_archive_extension(compression))
+
+    if not os.path.isfile(base_archive_path):
+        create_base_archive(board_riot_path, base_archive_path, compression, level)
+
+    return base_archive_path
+
+
+def create_base_archive(src_path, dest_path, compression=COMPRESSION_GZIP, level=None):
+    """
+    Write all entries of src_path as compressed tar stream without end-of-archive marker. The archive is written
+    under a temporary name and renamed into place afterwards
+
+    Parameters
+    ----------
+    src_path: string
+        Directory to archive
+    dest_path: string
+        Path the base archive is written to
+    compression: string (default =COMPRESSION_GZIP)
+        Name of the compression
+    level: int (default =None)
+        Compression level, None for the default level of the compression
+
+    """
+    level = get_compression_level(compression, level)
+
+    temp_path = "%s.tmp-%s" % (dest_path, uuid.uuid4())
+    temp_tar_path = "%s.tar" % temp_path
+
+    try:
+        tar = tarfile.open(temp_tar_path, "w")
+
+        for file_name in sorted(os.listdir(src_path)):
+            if not file_name.startswith("."):
+                tar.add(os.path.join(src_path, file_name), file_name)
+
+        end_of_members = tar.offset
+        tar.close()
+
+        # drop end-of-archive marker, so further members can be appended
+        with open(temp_tar_path, "r+b") as tar_file:
+            tar_file.truncate(end_of_members)
+
+        with open(temp_tar_path, "rb") as tar_file:
+            with open(temp_path, "wb") as dest_file:
+                compressed_file = _open_compressed_member(dest_file, compression, level)
+                copyfileobj(tar_file, compressed_file)
+                compressed_file.close()
+
+        os.rename(temp_path, dest_path)
+
+    finally:
+        for path in (temp_tar_path, temp_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def write_archive(dest_path, add_members, compression=COMPRESSION_GZIP, level=None):
+    """
+    Write compressed tar archive
+
+    Parameters
+    ----------
+    dest_path: string
+        Path the archive is written to
+    add_members: callable
+        Gets called with an open TarFile to add the members of the archive
+    compression: string (default =COMPRESSION_GZIP)
+        Name of the compression
+    level: int (default =None)
+        Compression level, None for the default level of the compression
+
+    """
+    with open(dest_path, "wb") as dest_file:
+        _write_compressed_tar(dest_file, add_members, compression, level)
+
+
+def write_layered_archive(base_archive_path, dest_path, add_layer, compression=COMPRESSION_GZIP, level=None):
+    """
+    Write archive consisting of a base archive and an appended layer
+
+    Parameters
+    ----------
+    base_archive_path: string
+        Path to the base archive, see create_base_archive. It has to use the same compression
+    dest_path: string
+        Path the archive is written to
+    add_layer: callable
+        Gets called with an open TarFile to add the members of the appended layer
+    compression: string (default =COMPRESSION_GZIP)
+        Name of the compression
+    level: int (default =None)
+        Compression level, None for the default level of the compression
+
+    """
+    with open(dest_path, "wb") as dest_file:
+
+        with open(base_archive_path, "rb") as base_file:
+            copyfileobj(base_file, dest_file)
+
+        _write_compressed_tar(dest_file, add_layer, compression, level)
+
+
+def _write_compressed_tar(file_obj, add_members, compression, level):
+    """Write a complete tar archive as new compressed member at the current position of `file_obj`."""
+    compressed_file = _open_compressed_member(file_obj, compression, get_compression_level(compression, level))
+
+    tar = tarfile.open(fileobj=compressed_file, mode="w")
+    try:
+        add_members(tar)
+
+    finally:
+        tar.close()
+        compressed_file.close()
+
+
+def add_directory(tar, arcname):
+    """
+    Add an empty directory entry to a tar archive
+
+    Parameters
+    ----------
+    tar: TarFile
+        Archive to add the directory to
+    arcname: string
+        Name of the directory within the archive
+
+    """
+    tarinfo = tarfile.TarInfo(arcname)
+    tarinfo.type = tarfile.DIRTYPE
+    tarinfo.mode = 0o755
+    tarinfo.mtime = int(time.time())
+
+    tar.addfile(tarinfo)
+
+
+def _open_compressed_member(file_obj, compression, level):
+    """Start a new compressed member at the current position of `file_obj`. Closing it keeps `file_obj` open."""
+    if compression == COMPRESSION_GZIP:
+        return gzip.GzipFile(filename="", mode="wb", compresslevel=level, fileobj=file_obj)
+
+    elif compression == COMPRESSION_XZ:
+        return lzma.LZMAFile(file_obj, mode="wb", preset=level)
+
+    elif compression == COMPRESSION_ZSTD:
+        return _ZstdMember(file_obj, level)
+
+    else:
+        return _UncompressedMember(file_obj)
+
+
+class _UncompressedMember(object):
+    """Write data to the underlying file as it is."""
+
+    def __init__(self, file_obj):
+        self._file_obj = file_obj
+        self._written = 0
+
+    def write(self, data):
+        self._file_obj.write(data)
+        self._written += len(data)
+
+    def tell(self):
+        return self._written
+
+    def close(self):
+        self._file_obj.flush()
+
+
+class _ZstdMember(object):
+    """Write data to the underlying file as one zstd frame, compressed by all cores in parallel."""
+
+    def __init__(self, file_obj, level):
+        compressor = zstandard.ZstdCompressor(level=level, threads=-1)
+        self._writer = compressor.stream_writer(file_obj)
+        self._written = 0
+
+    def write(self, data):
+        self._writer.write(data)
+        self._written += len(data)
+
+    def tell(self):
+        return self._written
+
+    def close(self):
+        self._writer.flush(zstandard.FLUSH_FRAME)
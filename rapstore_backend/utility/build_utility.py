@@ -11,19 +11,27 @@
 
 import base64
 import errno
-import glob
+import fcntl
 import logging
 import os
-import tarfile
 import time
 import uuid
-from shutil import copytree, rmtree, copyfile
+from distutils.spawn import find_executable
+from shutil import copy2, copyfile, rmtree
 from subprocess import Popen, PIPE, STDOUT
 
+import archive_utility
 
-def generate_stripped_repo(app_build_dir, stripped_riot_dir, temp_dir, board, app_name):
+# every application is built under the same name. RIOT compiles the name into every object (RIOT_APPLICATION in
+# riotbuild.h), so a name per application or build would prevent ccache from sharing objects between them
+APPLICATION_NAME = "application"
+
+
+def generate_stripped_archive(app_build_dir, stripped_riot_dir, dest_path, board, app_name, use_base_archive=False,
+                              compression=archive_utility.COMPRESSION_GZIP, compression_level=None):
     """
-    Create stripped version of the riot repository and return the path to it
+    Create tar archive of the stripped riot repository together with the application. Files are read from their
+    original location and written to the archive directly, without copying them to a temporary repository first
 
     Parameters
     ----------
@@ -31,91 +39,328 @@ def generate_stripped_repo(app_build_dir, stripped_riot_dir, temp_dir, board, ap
         Directory to take application data from
     stripped_riot_dir: string
         Directory in which the bare stripped RIOT repository is stored
-    temp_dir: string
-        Path to temporary directory of the requested application
+    dest_path: string
+        Path the archive is written to
     board: string
         Name of the Board
     app_name: string
         Name of the application
+    use_base_archive: bool (default =False)
+        Reuse the pre-built archive of the stripped repository of the board and only append the application to it
+    compression: string (default =COMPRESSION_GZIP)
+        Name of the compression, see archive_utility.COMPRESSIONS
+    compression_level: int (default =None)
+        Compression level, None for the default level of the compression
 
-    Returns
+    Raises
     -------
-    string
-        Path to the generated stripped RIOT repository
+    IOError
+        ELF file of the application does not exist
+    ValueError
+        Board is not a board of the stripped RIOT repository
 
     """
-    # TODO Adapt this to get 'files' as parameter, not from disk
+    elffile_path = app_outfile_path(os.path.join(app_build_dir, "bin", board), app_name, "elf")
 
-    bin_dir = os.path.join(app_build_dir, "bin", board)
+    # board tree and base archive are kept for later builds, so they are only created for builds which succeeded
+    if not os.path.isfile(elffile_path):
+        raise IOError("application was not built: %s" % elffile_path)
 
-    app_copy_dir = os.path.join(temp_dir, "RIOT_stripped", "generated_by_rapstore", app_name)
-    bin_copy_dir = os.path.join(app_copy_dir, "bin", board)
+    path_stripped_riot = os.path.join(stripped_riot_dir, "RIOT_stripped")
+    path_board_stripped_riot = get_board_stripped_riot_dir(path_stripped_riot, board)
 
+    def add_application(tar):
+        _add_application_to_archive(tar, app_build_dir, board, app_name)
 
-    path_stripped_riot = os.path.join(stripped_riot_dir, "RIOT_stripped")
-    stripped_repo_path = os.path.join(temp_dir, "RIOT_stripped")
+    def add_all(tar):
+        # stripped repository with the files of the requested board only
+        for file_name in sorted(os.listdir(path_board_stripped_riot)):
+            if not file_name.startswith("."):
+                tar.add(os.path.join(path_board_stripped_riot, file_name), file_name)
+
+        add_application(tar)
+
+    if use_base_archive:
+        base_archive_path = archive_utility.get_base_archive(path_board_stripped_riot, compression, compression_level)
+        archive_utility.write_layered_archive(base_archive_path, dest_path, add_application,
+                                              compression, compression_level)
+
+    else:
+        archive_utility.write_archive(dest_path, add_all, compression, compression_level)
+
+
+def _add_application_to_archive(tar, app_build_dir, board, app_name):
+    """Add Makefile and binaries of the application to `tar` as `generated_by_rapstore/<app_name>`."""
+    bin_dir = os.path.join(app_build_dir, "bin", board)
+
+    app_arc_dir = "/".join(("generated_by_rapstore", app_name))
+    bin_arc_dir = "/".join((app_arc_dir, "bin", board))
+
+    # parent directories of the application files
+    dir_names = bin_arc_dir.split("/")
+    for i in range(1, len(dir_names) + 1):
+        archive_utility.add_directory(tar, "/".join(dir_names[:i]))
 
-    # Create stripped repository wit firmwares
-    _create_riot_flasher(path_stripped_riot, stripped_repo_path,
-                         board=board)
     # Mandatory files
-    _copy_file_with_parents(os.path.join(app_build_dir, "Makefile"),
-                            os.path.join(app_copy_dir, "Makefile"))
-    _copy_file_with_parents(app_outfile_path(bin_dir, app_name, 'elf'),
-                            app_outfile_path(bin_copy_dir, app_name, 'elf'))
+    tar.add(os.path.join(app_build_dir, "Makefile"), "/".join((app_arc_dir, "Makefile")))
+    tar.add(app_outfile_path(bin_dir, app_name, 'elf'), app_outfile_path(bin_arc_dir, app_name, 'elf'))
+
     # Optional files
     optfiles = ('bin', 'hex')
     for optfile in optfiles:
         src = app_outfile_path(bin_dir, app_name, optfile)
-        dst = app_outfile_path(bin_copy_dir, app_name, optfile)
-        _copy_file_with_parents(src, dst, ignore_no_src=True)
 
-    return stripped_repo_path
+        if os.path.isfile(src):
+            tar.add(src, app_outfile_path(bin_arc_dir, app_name, optfile))
+
+
+def file_as_base64(path):
+    """
+    Get file content encoded in base64
+
+    Parameters
+    ----------
+    path: string
+        Path to file to be encoded
+
+    Returns
+    -------
+    string
+        Base64 representation of the file
+
+    """
+    with open(path, "rb") as file:
+        return base64.b64encode(file.read())
+
+
+def set_output_archive(build_result, archive_path, archive_extension, archive_dir=None):
+    """
+    Attach archive to a build result. Either the archive content is embedded as base64 or the archive is placed into
+    archive_dir and only its path is returned
+
+    Parameters
+    ----------
+    build_result: dict
+        Build result to fill in
+    archive_path: string
+        Path to the archive
+    archive_extension: string
+        File extension of the archive, e.g. "tar.gz"
+    archive_dir: string (default =None)
+        Directory to place the archive in, None to embed the archive as base64. The caller owns placed archives and
+        has to remove them
+
+    """
+    build_result["output_archive_extension"] = archive_extension
+
+    if archive_dir is None:
+        build_result["output_archive"] = file_as_base64(archive_path)
 
+    else:
+        dest_path = os.path.join(archive_dir, "RIOT_stripped-%s.%s" % (get_ticket_id(), archive_extension))
+        export_file(archive_path, dest_path)
 
-def zip_repo(src_path, dest_path):
+        build_result["output_archive_path"] = dest_path
+
+
+def export_file(src_path, dest_path):
     """
-    Create tar archive of given path and write tar-file to destination
+    Make a file available under another path without copying its content if possible. A hard link is created, so the
+    exported file stays valid after src_path is removed. If linking is not possible (e.g. different file systems) the
+    file is copied
 
     Parameters
     ----------
     src_path: string
-        Source path
+        Path to the file
     dest_path: string
-        Destination path
+        Path to export the file to
 
     """
-    tar = tarfile.open(dest_path, "w:gz")
-    for file_name in glob.glob(os.path.join(src_path, "*")):
-        tar.add(file_name, os.path.basename(file_name))
+    create_directories(os.path.dirname(dest_path))
 
-    tar.close()
+    _link_or_copy(src_path, dest_path)
 
 
-def file_as_base64(path):
+def materialize_tree(src_path, dest_path, ignore=None, copied_paths=()):
     """
-    Get file content encoded in base64
+    Create a working copy of a directory tree. Files are hard linked instead of copied, so no data is written. Files
+    which get changed in the copy have to be given as copied_paths, they are copied as usual. Changing a linked file
+    in place would change the original as well
 
     Parameters
     ----------
-    path: string
-        Path to file to be encoded
+    src_path: string
+        Directory to copy
+    dest_path: string
+        Path of the copy, must not exist
+    ignore: callable (default =None)
+        Gets called with a directory and the names of its entries and returns the names to leave out, see
+        shutil.copytree
+    copied_paths: array_like with string (default =())
+        Paths relative to src_path of files to copy instead of linking, e.g. ["Makefile"]
+
+    """
+    copied_paths = set(os.path.normpath(path) for path in copied_paths)
+
+    for dir_path, dir_names, file_names in os.walk(src_path, followlinks=True):
+
+        ignored_names = ignore(dir_path, dir_names + file_names) if ignore is not None else []
+
+        # os.walk does only descend into directories which are left in dir_names
+        dir_names[:] = [name for name in dir_names if name not in ignored_names]
+
+        rel_dir_path = os.path.relpath(dir_path, src_path)
+        dest_dir_path = os.path.normpath(os.path.join(dest_path, rel_dir_path))
+        os.makedirs(dest_dir_path)
+
+        for name in file_names:
+            if name in ignored_names:
+                continue
+
+            src_file_path = os.path.join(dir_path, name)
+            dest_file_path = os.path.join(dest_dir_path, name)
+
+            if os.path.normpath(os.path.join(rel_dir_path, name)) in copied_paths:
+                copy2(src_file_path, dest_file_path)
+
+            else:
+                _link_or_copy(src_file_path, dest_file_path)
+
+
+def _link_or_copy(src_path, dest_path):
+
+    try:
+        # link the file itself, not a symbolic link pointing to it
+        os.link(os.path.realpath(src_path), dest_path)
+
+    except OSError as e:
+        logging.debug(str(e))
+        copy2(src_path, dest_path)
+
+
+def get_ticket_id():
+    """Return a generated unique id
+
+    """
+    return str(time.time()) + str(uuid.uuid4())
+
+
+def lock_build_directory(parent_dir, prefix):
+    """
+    Get a build directory no other build is using. Directories are numbered and reused, so a build gets the same
+    paths as earlier builds and compiler output of them can be taken from ccache. A directory left over by an aborted
+    build is removed
+
+    Parameters
+    ----------
+    parent_dir: string
+        Directory containing the build directories
+    prefix: string
+        Name of the build directories without number, e.g. "application"
+
+    Returns
+    -------
+    tuple
+        Path to the build directory and lock file, which has to be passed to unlock_build_directory afterwards
+
+    """
+    create_directories(parent_dir)
+
+    number = 0
+    while True:
+        path = os.path.join(parent_dir, '%s%d' % (prefix, number))
+        lock_file = open('%s.lock' % path, 'w')
+
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+        except IOError as e:
+            lock_file.close()
+
+            if e.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+
+            number += 1
+            continue
+
+        if os.path.exists(path):
+            rmtree(path)
+
+        return path, lock_file
+
+
+def unlock_build_directory(lock_file):
+    """
+    Release a build directory locked with lock_build_directory. The directory has to be removed before
+
+    Parameters
+    ----------
+    lock_file: file
+        Lock file returned by lock_build_directory
+
+    """
+    lock_file.close()
+
+
+def get_riot_revision(riot_dir):
+    """
+    Get the commit hash of the RIOT repository
+
+    Parameters
+    ----------
+    riot_dir: string
+        Path to the RIOT repository
 
     Returns
     -------
     string
-        Base64 representation of the file
+        Commit hash, None if it can not be determined
 
     """
-    with open(path, "rb") as file:
-        return base64.b64encode(file.read())
+    dev_null = open(os.devnull, "w")
+    process = Popen(["git", "-C", riot_dir, "rev-parse", "HEAD"], stdout=PIPE, stderr=dev_null)
+    output = process.communicate()[0]
 
+    if process.returncode != 0:
+        logging.error("could not determine revision of %s", riot_dir)
+        return None
+
+    return output.strip()
 
-def get_ticket_id():
-    """Return a generated unique id
 
+def get_changed_paths(repo_dir, old_revision, new_revision):
     """
-    return str(time.time()) + str(uuid.uuid4())
+    Get paths of all files which differ between two revisions of a git repository
+
+    Parameters
+    ----------
+    repo_dir: string
+        Path to the repository
+    old_revision: string
+        Commit hash of the old revision
+    new_revision: string
+        Commit hash of the new revision
+
+    Returns
+    -------
+    array_like
+        Paths relative to the repository root, None if they can not be determined
+
+    """
+    if old_revision is None or new_revision is None:
+        return None
+
+    dev_null = open(os.devnull, "w")
+    process = Popen(["git", "-C", repo_dir, "diff", "--name-only", "--no-renames", old_revision, new_revision],
+                    stdout=PIPE, stderr=dev_null)
+    output = process.communicate()[0]
+
+    if process.returncode != 0:
+        logging.error("could not determine changes of %s between %s and %s", repo_dir, old_revision, new_revision)
+        return None
+
+    return [path for path in output.splitlines() if path]
 
 
 def get_temporary_directory(path, ticket_id):
@@ -169,7 +414,12 @@ def app_outfile_path(path, app_name, extension):
     return os.path.join(path, filename)
 
 
-def execute_makefile(app_build_dir, board, app_name):
+def archive_file_name(compression_level, archive_extension):
+    """File name of an application archive in the application cache."""
+    return 'RIOT_stripped-%d.%s' % (compression_level, archive_extension)
+
+
+def execute_makefile(app_build_dir, board, app_name, jobs=None, env=None):
     """
     Run make on given makefile and override variables
 
@@ -181,6 +431,11 @@ def execute_makefile(app_build_dir, board, app_name):
         Board name
     app_name: string
         Application name
+    jobs: int (default =None)
+        Number of jobs make runs in parallel. Ignored if started by a make with jobserver, the jobs of the jobserver
+        are shared then
+    env: dict (default =None)
+        Environment of make, e.g. from get_ccache_environment. None for the environment of this process
 
     Returns
     -------
@@ -201,12 +456,128 @@ def execute_makefile(app_build_dir, board, app_name):
            "BOARD=%s" % board,
            "BINDIRBASE=%s" % bindirbase,
            "ELFFILE=%s" % elffile]
+
+    if jobs is not None and '--jobserver' not in os.environ.get('MAKEFLAGS', ''):
+        cmd.append("-j%d" % jobs)
+
     logging.debug('make: %s', cmd)
 
-    process = Popen(cmd, stdout=PIPE, stderr=STDOUT)
+    process = Popen(cmd, stdout=PIPE, stderr=STDOUT, env=env)
     return process.communicate()[0]
 
 
+def replace_application_name(path, application_name):
+    """
+    Replace application name in line which starts with "APPLICATION="
+
+    Parameters
+    ----------
+    path: string
+        Path to the file
+
+    application_name: string
+        Name of the application
+
+    """
+
+    # Save the old one to check later in case there is an error
+    copyfile(path, path + '.old')
+
+    with open(path + '.old', 'r') as old_makefile:
+        with open(path, 'w') as makefile:
+
+            for line in old_makefile.readlines():
+                if line.replace(' ', '').startswith('APPLICATION='):
+                    line = 'APPLICATION = %s\n' % application_name
+
+                makefile.write(line)
+
+
+def get_ccache_environment(ccache_dir, max_size, compilers, base_dir=None):
+    """
+    Get environment for make which runs the given compilers through ccache. A directory with links named like the
+    compilers and pointing to ccache is put in front of PATH, ccache then runs the compiler found next in PATH
+
+    Parameters
+    ----------
+    ccache_dir: string
+        Directory of the cache, None to build without ccache
+    max_size: string
+        Size limit of the cache, e.g. "5G"
+    compilers: array_like with string
+        Names of the compilers, e.g. "arm-none-eabi-gcc"
+    base_dir: string (default =None)
+        Absolute paths below this directory are made relative to the build directory before they are hashed, so
+        objects are shared between build directories at the same depth. None to hash absolute paths
+
+    Returns
+    -------
+    dict
+        Environment variables, None to keep the environment if ccache is disabled or not installed
+
+    """
+    if ccache_dir is None:
+        return None
+
+    ccache_path = find_executable('ccache')
+
+    if ccache_path is None:
+        logging.error('ccache not found, building without it')
+        return None
+
+    compilers_dir = os.path.join(ccache_dir, 'compilers')
+
+    create_directories(compilers_dir)
+
+    for compiler in compilers:
+        link_path = os.path.join(compilers_dir, compiler)
+
+        if not os.path.lexists(link_path):
+            try:
+                os.symlink(ccache_path, link_path)
+
+            except OSError as e:
+                # created by another build in the meantime
+                if e.errno != errno.EEXIST:
+                    raise
+
+    env = dict(os.environ)
+    env['PATH'] = os.pathsep.join((compilers_dir, env.get('PATH', os.defpath)))
+    env['CCACHE_DIR'] = ccache_dir
+    env['CCACHE_MAXSIZE'] = max_size
+    # the working directory only ends up in debug information, which is not used
+    env['CCACHE_NOHASHDIR'] = '1'
+
+    if base_dir is not None:
+        env['CCACHE_BASEDIR'] = base_dir
+
+    return env
+
+
+def get_supported_boards(app_dir):
+    """
+    Get all supported boards for an application
+
+    Parameters
+    ----------
+    app_dir: string
+        Path to the application directory
+
+    Returns
+    -------
+    array_like
+        List of board names of supported boards
+
+    """
+    # command to get supported devices from .murdock script in RIOT repository within get_supported_boards()
+    # 2>/dev/null replaced by stderr=open(os.devnull, 'w')
+    dev_null = open(os.devnull, "w")
+    process = Popen(["make", "--no-print-directory", "-C", app_dir, "info-boards-supported"], stdout=PIPE, stderr=dev_null)
+    output = process.communicate()[0]
+
+    return output.split()
+
+
 def get_bindirbase(app_build_dir):
     return os.path.abspath(os.path.join(app_build_dir, "bin"))
 
@@ -221,50 +592,107 @@ def get_bindir(app_build_dir, board):
     return bin_dir
 
 
-def _copy_file_with_parents(src, dst, ignore_no_src=False):
-    """Copy `src` to `dst` and create `dst` parents directories.
+def get_boards_stripped_riot_dir(stripped_riot_path):
+    """
+    Return path to the directory containing the pre-stripped trees of all boards
+
+    Parameters
+    ----------
+    stripped_riot_path: string
+        Path to the stripped RIOT repository
+
+    Returns
+    -------
+    string
+        Path to the directory of pre-stripped trees
 
-    If `src` does not exist and `ignore_no_src` is set, do nothing.
     """
-    if not os.path.isfile(src) and ignore_no_src:
-        return
+    return os.path.realpath(stripped_riot_path) + "_boards"
 
-    dst_dir = os.path.dirname(dst)
-    create_directories(dst_dir)
 
-    copyfile(src, dst)
+def get_board_stripped_riot_dir(stripped_riot_path, board):
+    """
+    Return path to the stripped RIOT repository containing only the given board. It is created if not existing yet
 
+    Parameters
+    ----------
+    stripped_riot_path: string
+        Path to the stripped RIOT repository
+    board: string
+        Name of the board
 
-def _create_riot_flasher(src_path, dest_path, board=None):
-    """Create a minimal RIOT repository to allow flashing.
+    Returns
+    -------
+    string
+        Path to the pre-stripped tree of the board
+
+    Raises
+    -------
+    ValueError
+        Board is not a board of the stripped RIOT repository
+
+    """
+    # resolve the active version once, it may be replaced while the tree is created
+    stripped_riot_path = os.path.realpath(stripped_riot_path)
+
+    # board comes from the client, it must not lead out of the boards directory
+    boards_dir = os.path.join(stripped_riot_path, "boards")
+    if board not in os.listdir(boards_dir) or not is_board(boards_dir, board):
+        raise ValueError("unknown board: %s" % board)
+
+    board_riot_path = os.path.join(get_boards_stripped_riot_dir(stripped_riot_path), board)
+
+    if not os.path.isdir(board_riot_path):
+        create_board_stripped_riot_dir(stripped_riot_path, board_riot_path, board)
 
-    If `board` is set, remove unused boards
+    return board_riot_path
+
+
+def create_board_stripped_riot_dir(src_path, dest_path, board):
+    """
+    Copy stripped RIOT repository without unnecessary boards. The tree is built under a temporary name and renamed
+    into place afterwards, so concurrent builds never see a partial tree
 
     Parameters
     ----------
     src_path: string
-        Path to riot repository you want to be stripped
+        Path to the stripped RIOT repository
     dest_path: string
-        Path to store the stripped riot repository
+        Path to store the pre-stripped tree of the board
     board: string
         Name of the board
+
     """
-    copytree(src_path, dest_path)
-    if board:
-        _flasher_remove_unnecessary_boards(dest_path, board)
+    temp_path = "%s.tmp-%s" % (dest_path, uuid.uuid4())
+    boards_dir = os.path.join(src_path, "boards")
 
+    def ignore_unnecessary_boards(path, names):
+        if os.path.normpath(path) != os.path.normpath(boards_dir):
+            return []
 
-def _flasher_remove_unnecessary_boards(dest_path, board):
-    """Remove all unnecessary boards from `boards` directory."""
-    boards_dir = os.path.join(dest_path, 'boards')
-    for entry in os.listdir(boards_dir):
-        entry_path = os.path.join(boards_dir, entry)
-        if os.path.isfile(entry_path):
-            continue
-        if (entry in ('include', board)) or ('common' in entry):
-            continue
+        return [name for name in names if _is_unnecessary_board(boards_dir, name, board)]
 
-        try:
-            rmtree(entry_path)
-        except Exception as e:
-            logging.error(str(e), exc_info=True)
+    create_directories(os.path.dirname(dest_path))
+
+    # the tree is only read, so all files can be linked
+    materialize_tree(src_path, temp_path, ignore=ignore_unnecessary_boards)
+
+    try:
+        os.rename(temp_path, dest_path)
+
+    except OSError:
+        # tree was created concurrently
+        rmtree(temp_path)
+
+
+def is_board(boards_dir, entry):
+    """Check if `entry` of `boards` directory is a board and not shared code of several boards."""
+    if os.path.isfile(os.path.join(boards_dir, entry)):
+        return False
+
+    return not ((entry == 'include') or ('common' in entry))
+
+
+def _is_unnecessary_board(boards_dir, entry, board):
+    """Check if `entry` of `boards` directory is not needed for `board`."""
+    return is_board(boards_dir, entry) and entry != board